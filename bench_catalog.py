@@ -0,0 +1,79 @@
+"""Katta katalogda ro'yxat/qidiruv so'rovlarini o'lchash.
+
+Foydalanish:
+    python bench_catalog.py [kinolar_soni]
+
+Vaqtinchalik SQLite bazasida ORM obyektlari + to_dict() (eski usul) va
+ustun proyeksiyasi (get_all_movies / search_movies_db) solishtiriladi,
+xatoli so'rovlar uchun trigram indeksi (suggest_movies) ham o'lchanadi.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+os.environ.pop("BOT_TOKEN", None)
+
+import bot  # noqa: E402
+from models import db, Movie  # noqa: E402
+
+
+def seed(count):
+    """Bazani sun'iy kinolar bilan to'ldirish"""
+    with bot.app.app_context():
+        rows = [
+            {
+                'movie_id': f"-100123_{i}",
+                'name': f"Kino {i} qism {i % 97}",
+                'search_key': bot.normalize_search_key(f"Kino {i} qism {i % 97}"),
+                'file_id': f"BAACAgIAAxkBAAI{i:012d}",
+                'file_type': ('video', 'document', 'audio', 'photo')[i % 4],
+                'channel_id': "-100123",
+                'message_id': str(i),
+            }
+            for i in range(count)
+        ]
+        db.session.execute(db.insert(Movie), rows)
+        db.session.commit()
+
+
+def orm_all_movies():
+    """Eski usul: to'liq ORM obyektlari"""
+    with bot.app.app_context():
+        movies = Movie.query.order_by(Movie.created_at.desc()).all()
+        return [(m.movie_id, m.to_dict()) for m in movies]
+
+
+def orm_search(query):
+    """Eski usul: ORM qidiruv"""
+    with bot.app.app_context():
+        movies = Movie.query.filter(Movie.name.ilike(f'%{query}%')).all()
+        return [(m.movie_id, m.to_dict()) for m in movies]
+
+
+def measure(label, func, repeat=5):
+    """O'rtacha vaqt va eng yuqori xotira"""
+    func()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - started) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms   peak {peak / 1024:9.0f} KiB")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    seed(count)
+    print(f"Katalog: {count} ta kino\n")
+    measure("list: ORM + to_dict", orm_all_movies)
+    measure("list: projection", bot.get_all_movies)
+    measure("search: ORM + to_dict", lambda: orm_search("qism 1"))
+    measure("search: projection", lambda: bot.search_movies_db("qism 1"))
+    bot.fuzzy_index.rebuild(bot.load_fuzzy_rows)
+    measure("fuzzy: trigram index", lambda: bot.suggest_movies("kno 123 qsm"))
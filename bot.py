@@ -1,36 +1,229 @@
 import os
+import sys
+import time
 import logging
 import asyncio
+import atexit
+import contextvars
+import json
+import queue
 import threading
+import select
 import random
+import re
 import string
-from datetime import datetime
-from flask import Flask, request
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import secrets
+import hashlib
+import hmac
+import html
+import io
+import tracemalloc
+import math
+import functools
+import heapq
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest, TelegramError
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     CallbackQueryHandler, ContextTypes, filters
 )
-from models import db, Movie, User, AdminLink
+from models import db, Movie, MovieStat, User, ArchivedUser, AdminLink, SchemaVersion, DailyStat, CatalogVersion
+
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', 10))
+LOG_SAMPLE_WINDOW = float(os.environ.get('LOG_SAMPLE_WINDOW', 60))
+
+# Joriy update haqida ma'lumot: update_id, user_id, handler
+log_context = contextvars.ContextVar('log_context', default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Bir qatorli JSON log yozuvi"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'func': record.funcName,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or {})
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ErrorSampler(logging.Filter):
+    """Bir xil xato shablonini har oynada LOG_SAMPLE_BURST tagacha o'tkazish"""
+
+    def __init__(self, burst, window):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.windows = {}  # (logger, shablon) -> [boshlanish, soni, tashlanganlar]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        record.context = log_context.get()
+        if record.levelno < logging.WARNING:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            state = self.windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                record.suppressed = state[2] if state else 0
+                self.windows[key] = [now, 1, 0]
+                return True
+            state[1] += 1
+            if state[1] <= self.burst:
+                return True
+            state[2] += 1
+            return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Yozuvni formatlamasdan navbatga qo'yadi: formatlash va I/O listener thread'ida"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging():
+    """Navbatli (asinxron) logging: handler'lar faqat navbatga yozadi"""
+    stream = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(ErrorSampler(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
+STARTED_AT = time.perf_counter()
+startup_timings = {}
+
+
+@contextmanager
+def startup_phase(name):
+    """Ishga tushish bosqichi vaqtini o'lchash"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+        logger.info("Startup phase %s: %.0f ms", name, startup_timings[name] * 1000)
+
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY") or "kino-bot-secret-key"
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+REPLICA_URLS = [u.strip() for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+app.config["SQLALCHEMY_BINDS"] = {f"replica_{i}": url for i, url in enumerate(REPLICA_URLS)}
+
+
+def env_flag(name, default):
+    """Muhit o'zgaruvchisini bool sifatida o'qish"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def build_engine_options():
+    """Connection pool sozlamalari (muhit o'zgaruvchilaridan)"""
+    if env_flag('DB_PGBOUNCER', False):
+        # Tranzaksiya pooler (PgBouncer/Supavisor) ulanishlarni o'zi saqlaydi
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": int(os.environ.get('DB_POOL_SIZE', min(32, (os.cpu_count() or 1) + 4))),
+        "max_overflow": int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 300)),
+        "pool_pre_ping": env_flag('DB_POOL_PRE_PING', True),
+    }
+
+
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = build_engine_options()
 db.init_app(app)
 
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q',
+    'ғ': 'g', 'ҳ': 'h',
+}
+# o' / g' dagi barcha apostrof variantlari olib tashlanadi: o'zbek == o‘zbek == ozbek
+APOSTROPHES = "'`‘’ʻʼ´"
+SEARCH_KEY_TABLE = str.maketrans({**CYRILLIC_TO_LATIN, **{a: '' for a in APOSTROPHES}})
+NON_ALNUM_RE = re.compile(r'[\W_]+')
+
+
+def normalize_search_key(text):
+    """Qidiruv kaliti: kichik harf, lotinga o'girilgan, tinish belgilarisiz"""
+    if not text:
+        return ''
+    key = text.casefold().translate(SEARCH_KEY_TABLE)
+    return NON_ALNUM_RE.sub(' ', key).strip()
+
+
+def schema_fingerprint():
+    """Modellar sxemasining xeshi (jadval, ustun, tur, indeks)"""
+    parts = []
+    for table in sorted(db.metadata.sorted_tables, key=lambda t: t.name):
+        for column in table.columns:
+            parts.append(f"{table.name}.{column.name}:{column.type}:{column.unique}:{column.index}")
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def stored_schema_version():
+    """Bazadagi sxema versiyasi; jadval bo'lmasa None"""
+    try:
+        return db.session.execute(db.select(SchemaVersion.version).limit(1)).scalar()
+    except DBAPIError:
+        db.session.rollback()
+        return None
+
+
 def migrate_database():
     """Database schema migrations"""
     with app.app_context():
+        fingerprint = schema_fingerprint()
+        if stored_schema_version() == fingerprint:
+            logger.info("Database schema unchanged, skipping migration")
+            return
+
         try:
             inspector = db.inspect(db.engine)
             tables = inspector.get_table_names()
@@ -43,24 +236,595 @@ def migrate_database():
                     # Eski table'ni o'chirish
                     db.session.execute(db.text('DROP TABLE IF EXISTS admin_links'))
                     db.session.commit()
+
+            if 'movies' in tables:
+                columns = [col['name'] for col in inspector.get_columns('movies')]
+                if 'search_key' not in columns:
+                    logger.info("Adding movies.search_key column...")
+                    db.session.execute(db.text('ALTER TABLE movies ADD COLUMN search_key VARCHAR(500)'))
+                    db.session.execute(db.text('CREATE INDEX IF NOT EXISTS ix_movies_search_key ON movies (search_key)'))
+                    db.session.commit()
+                if 'file_unique_id' not in columns:
+                    logger.info("Adding movies.file_unique_id column...")
+                    db.session.execute(db.text('ALTER TABLE movies ADD COLUMN file_unique_id VARCHAR(255)'))
+                    db.session.execute(db.text(
+                        'CREATE UNIQUE INDEX IF NOT EXISTS ix_movies_file_unique_id ON movies (file_unique_id)'
+                    ))
+                    db.session.commit()
         except Exception as e:
-            logger.warning(f"Migration notice: {e}")
+            db.session.rollback()
+            logger.warning("Migration notice: %s", e)
         
         # Barcha table'larni to'g'ri schema bilan yaratish
         db.create_all()
+        # create_all mavjud jadvallarga yangi indekslarni qo'shmaydi
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        backfill_search_keys()
+        create_trigram_index()
+
+        db.session.execute(db.delete(SchemaVersion))
+        db.session.add(SchemaVersion(version=fingerprint))
+        db.session.commit()
         logger.info("Database initialized successfully")
 
-migrate_database()
+
+def backfill_search_keys(batch_size=500):
+    """search_key bo'sh bo'lgan kinolarni to'ldirish"""
+    while True:
+        movies = Movie.query.filter(Movie.search_key.is_(None)).limit(batch_size).all()
+        if not movies:
+            break
+        for movie in movies:
+            movie.search_key = normalize_search_key(movie.name)
+        db.session.commit()
+
+
+def create_trigram_index():
+    """PostgreSQL'da '%...%' qidiruvi uchun pg_trgm GIN indeksi"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.execute(db.text(
+            'CREATE INDEX IF NOT EXISTS ix_movies_search_key_trgm '
+            'ON movies USING gin (search_key gin_trgm_ops)'
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Trigram index notice: %s", e)
+
+with startup_phase("migrate"):
+    migrate_database()
 
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 ADMIN_ID = os.environ.get('ADMIN_ID')
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
 PORT = int(os.environ.get('PORT', 5000))
+BOT_READY_TIMEOUT = float(os.environ.get('BOT_READY_TIMEOUT', 15))
+PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+# HTTP so'rovi worker ichida kutadi: gunicorn timeout'idan (default 30 s) ancha kam bo'lsin
+PROFILE_HTTP_MAX_SECONDS = float(os.environ.get('PROFILE_HTTP_MAX_SECONDS', 20))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
 MOVIES_PER_PAGE = 20
+THROTTLE_RATE = float(os.environ.get('THROTTLE_RATE', 1.0))
+THROTTLE_BURST = float(os.environ.get('THROTTLE_BURST', 5))
+THROTTLE_MAX_USERS = int(os.environ.get('THROTTLE_MAX_USERS', 50000))
+SEARCH_DEBOUNCE = float(os.environ.get('SEARCH_DEBOUNCE', 1.0))
+THROTTLE_NOTICE_INTERVAL = float(os.environ.get('THROTTLE_NOTICE_INTERVAL', 10))
+STATE_TTL = int(os.environ.get('STATE_TTL', 3600))
+STATE_MAX_ENTRIES = int(os.environ.get('STATE_MAX_ENTRIES', 10000))
+STATE_FILE = os.environ.get('STATE_FILE')
+SEARCH_TOKEN_TTL = int(os.environ.get('SEARCH_TOKEN_TTL', 3600))
+SEARCH_TOKEN_MAX_ENTRIES = int(os.environ.get('SEARCH_TOKEN_MAX_ENTRIES', 5000))
+SEARCH_TOKEN_MAX_ROWS = int(os.environ.get('SEARCH_TOKEN_MAX_ROWS', 500))
+SEARCH_TOKEN_MAX_TOTAL_ROWS = int(os.environ.get('SEARCH_TOKEN_MAX_TOTAL_ROWS', 200000))
+DEAD_LETTER_FILE = os.environ.get('DEAD_LETTER_FILE', 'dead_letters.jsonl')
+DEAD_LETTER_MAX_ATTEMPTS = int(os.environ.get('DEAD_LETTER_MAX_ATTEMPTS', 5))
+DEAD_LETTER_MAX_BYTES = int(os.environ.get('DEAD_LETTER_MAX_BYTES', 10 * 1024 * 1024))
+REPLAY_RATE = float(os.environ.get('REPLAY_RATE', 20))
+BACKFILL_RATE = float(os.environ.get('BACKFILL_RATE', 20))
+BACKFILL_MAX_ATTEMPTS = int(os.environ.get('BACKFILL_MAX_ATTEMPTS', 3))
+SOURCE_CHANNELS = [c.strip() for c in os.environ.get('SOURCE_CHANNELS', '').split(',') if c.strip()]
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 100))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 2.0))
+POPULARITY_FLUSH_INTERVAL = float(os.environ.get('POPULARITY_FLUSH_INTERVAL', 30))
+TRENDING_HALF_LIFE = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 24)) * 3600
+TOP_CACHE_TTL = float(os.environ.get('TOP_CACHE_TTL', 60))
+TOP_LIMIT = int(os.environ.get('TOP_LIMIT', 20))
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get('ROLLUP_FLUSH_INTERVAL', 60))
+STATS_DAYS = int(os.environ.get('STATS_DAYS', 7))
+CATALOG_CACHE = env_flag('CATALOG_CACHE', False)
+CATALOG_POLL_INTERVAL = float(os.environ.get('CATALOG_POLL_INTERVAL', 5))
+FUZZY_MIN_SCORE = float(os.environ.get('FUZZY_MIN_SCORE', 0.3))
+FUZZY_LIMIT = int(os.environ.get('FUZZY_LIMIT', 5))
+FUZZY_BUDGET_MS = float(os.environ.get('FUZZY_BUDGET_MS', 50))
+FUZZY_REBUILD_INTERVAL = float(os.environ.get('FUZZY_REBUILD_INTERVAL', 600))
+PUBLISH_CHANNELS = [c.strip() for c in os.environ.get('PUBLISH_CHANNELS', '').split(',') if c.strip()]
+PUBLISH_CONCURRENCY = int(os.environ.get('PUBLISH_CONCURRENCY', 5))
+PUBLISH_RATE = float(os.environ.get('PUBLISH_RATE', 25))
+PUBLISH_MAX_ATTEMPTS = int(os.environ.get('PUBLISH_MAX_ATTEMPTS', 3))
+PUBLISH_UTC_OFFSET = float(os.environ.get('PUBLISH_UTC_OFFSET', 5))
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ADMIN_LINK_RETENTION_DAYS = int(os.environ.get('ADMIN_LINK_RETENTION_DAYS', 180))
+MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', 1000))
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get('MAINTENANCE_INTERVAL_HOURS', 24))
 
 application = None
 loop = None
 bot_ready = threading.Event()
+background_tasks = set()
+
+metrics = {}
+metrics_lock = threading.Lock()
+gauges = {}
+
+
+def inc_metric(name, value=1):
+    """Hisoblagichni oshirish (/metrics uchun)"""
+    with metrics_lock:
+        metrics[name] = metrics.get(name, 0) + value
+
+
+def register_gauge(name, func):
+    """/metrics so'ralganda hisoblanadigan qiymat"""
+    gauges[name] = func
+
+
+def get_rss_bytes():
+    """Jarayonning joriy xotirasi (RSS, bayt)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+register_gauge("process_rss_bytes", get_rss_bytes)
+
+
+def instrument_pools():
+    """Har bir engine pool'i uchun hisoblagich va gauge'lar"""
+    with app.app_context():
+        engines = dict(db.engines)
+    for bind_key, engine in engines.items():
+        label = bind_key or "primary"
+        pool = engine.pool
+
+        event.listen(pool, "connect", lambda *args, label=label: inc_metric(f"db_pool_{label}_connects"))
+        event.listen(pool, "checkout", lambda *args, label=label: inc_metric(f"db_pool_{label}_checkouts"))
+        event.listen(pool, "invalidate", lambda *args, label=label: inc_metric(f"db_pool_{label}_invalidated"))
+
+        if hasattr(pool, "checkedout"):
+            register_gauge(f"db_pool_{label}_checked_out", pool.checkedout)
+            register_gauge(f"db_pool_{label}_overflow", lambda pool=pool: max(pool.overflow(), 0))
+            register_gauge(f"db_pool_{label}_size", pool.size)
+            # Pool to'la band: yangi so'rovlar pool_timeout gacha kutadi
+            register_gauge(
+                f"db_pool_{label}_saturated",
+                lambda pool=pool: int(pool.checkedout() >= pool.size() + pool._max_overflow)
+            )
+
+
+instrument_pools()
+
+
+class Throttle:
+    """Foydalanuvchi bo'yicha token bucket va qidiruv debounce"""
+
+    def __init__(self, rate, burst, max_users):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.last_search = OrderedDict()  # key -> (vaqt, navbat raqami)
+        self.last_notice = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _touch(self, store, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_users:
+            store.popitem(last=False)
+
+    def allow(self, key):
+        """Token bo'lsa True, aks holda False"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._touch(self.buckets, key, (tokens, now))
+        return allowed
+
+    def debounce(self, key, window):
+        """Qidiruvni ro'yxatga olish: (navbat raqami, kutish soniyalari)"""
+        now = time.monotonic()
+        with self.lock:
+            last, seq = self.last_search.get(key, (None, 0))
+            seq += 1
+            self._touch(self.last_search, key, (now, seq))
+        delay = 0 if last is None else max(0.0, window - (now - last))
+        return seq, delay
+
+    def is_latest(self, key, seq):
+        """Kutish davomida yangi qidiruv kelmagan bo'lsa True"""
+        with self.lock:
+            entry = self.last_search.get(key)
+        return entry is not None and entry[1] == seq
+
+    def should_notify(self, key, interval):
+        """Cheklov haqida ogohlantirish interval soniyada bir martadan ko'p emas"""
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_notice.get(key)
+            if last is not None and now - last < interval:
+                return False
+            self._touch(self.last_notice, key, now)
+        return True
+
+
+throttle = Throttle(THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS)
+
+
+class SingleFlight:
+    """Bir xil parallel so'rovlar uchun bitta DB chaqiruvi (single-flight)"""
+
+    class Call:
+        __slots__ = ('event', 'result', 'error')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlight.Call()
+
+        if not leader:
+            inc_metric("singleflight_shared")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+
+single_flight = SingleFlight()
+
+
+class StateStore:
+    """Foydalanuvchi suhbat holati: TTL va hajm chegarasi bilan"""
+
+    def __init__(self, ttl, max_entries, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()  # user_id -> (expires_at, dict)
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("State file notice: %s", e)
+            return
+        now = time.time()
+        for key, (expires_at, values) in sorted(saved.items(), key=lambda item: item[1][0]):
+            if expires_at > now:
+                self.entries[key] = (expires_at, values)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("State file notice: %s", e)
+
+    def _expire(self, now):
+        while self.entries:
+            key, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at > now:
+                break
+            del self.entries[key]
+            inc_metric("state_expired")
+
+    def get(self, user_id):
+        """Foydalanuvchi holati (nusxa); yo'q bo'lsa bo'sh dict"""
+        with self.lock:
+            self._expire(time.time())
+            entry = self.entries.get(str(user_id))
+            return dict(entry[1]) if entry else {}
+
+    def update(self, user_id, **values):
+        """Holatga qiymat qo'shish va muddatini yangilash"""
+        key = str(user_id)
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.pop(key, None)
+            current = entry[1] if entry else {}
+            current.update(values)
+            self.entries[key] = (now + self.ttl, current)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                inc_metric("state_evicted")
+            self._save()
+
+    def pop(self, user_id, *fields):
+        """Maydonlarni o'chirish; bo'sh holat butunlay o'chiriladi"""
+        key = str(user_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return
+            for field in fields:
+                entry[1].pop(field, None)
+            if not entry[1]:
+                del self.entries[key]
+            self._save()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+conversation_state = StateStore(STATE_TTL, STATE_MAX_ENTRIES, STATE_FILE)
+register_gauge("conversation_state_entries", lambda: len(conversation_state))
+
+
+class SearchResultStore:
+    """Qidiruv natijalari uchun qisqa token (callback_data 64 bayt chegarasi uchun).
+
+    Faqat movie_id'lar saqlanadi; token boshiga va jami qatorlar soniga chegara bor.
+    """
+
+    def __init__(self, ttl, max_entries, max_rows, max_total_rows):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.max_total_rows = max_total_rows
+        self.entries = OrderedDict()  # token -> (expires_at, topilganlar soni, movie_id'lar)
+        self.total_rows = 0
+        self.lock = threading.Lock()
+
+    def put(self, results):
+        """Natijalar (birinchi max_rows tasi) id'larini saqlab token qaytarish"""
+        token = secrets.token_urlsafe(6)
+        movie_ids = tuple(row[0] for row in results[:self.max_rows])
+        now = time.monotonic()
+        with self.lock:
+            self.entries[token] = (now + self.ttl, len(results), movie_ids)
+            self.total_rows += len(movie_ids)
+            while self.entries:
+                oldest, (expires_at, _, ids) = next(iter(self.entries.items()))
+                if (expires_at > now and len(self.entries) <= self.max_entries
+                        and self.total_rows <= self.max_total_rows):
+                    break
+                del self.entries[oldest]
+                self.total_rows -= len(ids)
+        return token
+
+    def get(self, token):
+        """(topilganlar soni, movie_id'lar); muddati o'tgan yoki yo'q bo'lsa None"""
+        with self.lock:
+            entry = self.entries.get(token)
+            if not entry or entry[0] <= time.monotonic():
+                return None
+            return entry[1], entry[2]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+search_results = SearchResultStore(
+    SEARCH_TOKEN_TTL, SEARCH_TOKEN_MAX_ENTRIES, SEARCH_TOKEN_MAX_ROWS, SEARCH_TOKEN_MAX_TOTAL_ROWS
+)
+register_gauge("search_tokens", lambda: len(search_results))
+register_gauge("search_token_rows", lambda: search_results.total_rows)
+
+# Qayta yuborilayotgan yozuvning urinishlar soni (error handler uchun)
+replay_attempts = contextvars.ContextVar('replay_attempts', default=0)
+# Qayta bajarilayotgan update xatolari (process_update xatoni o'zi yutadi)
+replay_failures = contextvars.ContextVar('replay_failures', default=None)
+
+
+def is_transient_error(error):
+    """Qayta urinish foyda beradigan xato: tarmoq, Telegram limiti yoki DB ulanishi"""
+    if isinstance(error, BadRequest):
+        return False
+    return isinstance(error, (NetworkError, RetryAfter, TimeoutError, OperationalError))
+
+
+class DeadLetterStore:
+    """Bajarilmagan update va yuborishlar uchun JSONL fayl"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.count = sum(1 for line in f if line.strip())
+
+    def add(self, kind, payload, error, attempts=None):
+        """Yozuv qo'shish; doimiy xato, urinishlar yoki fayl hajmi chegarasidan oshsa tashlanadi"""
+        if not is_transient_error(error):
+            inc_metric("dead_letter_permanent")
+            return
+        if attempts is None:
+            attempts = replay_attempts.get()
+        if attempts >= DEAD_LETTER_MAX_ATTEMPTS:
+            inc_metric("dead_letter_dropped")
+            logger.error("Dead letter dropped after %s attempts: %s", attempts, kind)
+            return
+        entry = {
+            'kind': kind,
+            'payload': payload,
+            'error': str(error),
+            'error_type': type(error).__name__,
+            'attempts': attempts,
+            'failed_at': datetime.utcnow().isoformat(),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self.lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size + len(line) > DEAD_LETTER_MAX_BYTES:
+                inc_metric("dead_letter_overflow")
+                logger.error("Dead letter file full (%s bytes), dropping: %s", size, kind)
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            self.count += 1
+        inc_metric(f"dead_letter_{kind}")
+
+    def take(self, limit):
+        """Birinchi limit ta yozuvni fayldan olib tashlab qaytarish"""
+        with self.lock:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, encoding='utf-8') as f:
+                lines = [line for line in f if line.strip()]
+            taken, rest = lines[:limit], lines[limit:]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(rest)
+            os.replace(tmp_path, self.path)
+            self.count = len(rest)
+        return [json.loads(line) for line in taken]
+
+    def restore(self, entries):
+        """Bajarilmay qolgan yozuvlarni fayl boshiga qaytarish"""
+        if not entries:
+            return
+        lines = [json.dumps(entry, ensure_ascii=False, default=str) + '\n' for entry in entries]
+        with self.lock:
+            rest = []
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as f:
+                    rest = [line for line in f if line.strip()]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines + rest)
+            os.replace(tmp_path, self.path)
+            self.count = len(lines) + len(rest)
+
+    def __len__(self):
+        return self.count
+
+
+dead_letters = DeadLetterStore(DEAD_LETTER_FILE)
+register_gauge("dead_letter_entries", lambda: len(dead_letters))
+
+
+def coalesced(func):
+    """Bir xil argumentli parallel chaqiruvlar natijani bo'lishadi"""
+    @functools.wraps(func)
+    def wrapper(*args):
+        return single_flight.do((func.__name__, args), func, *args)
+    return wrapper
+
+
+def is_throttled(user_id, kind):
+    """Flood tekshiruvi (admin bundan mustasno)"""
+    if str(user_id) == ADMIN_ID:
+        return False
+    if throttle.allow(user_id):
+        inc_metric(f"throttle_allowed_{kind}")
+        return False
+    inc_metric(f"throttle_rejected_{kind}")
+    return True
+
+
+replica_state = {'last_write': 0.0, 'down_until': {}}
+
+
+def mark_catalog_write():
+    """Katalog yozildi: keyingi o'qishlar biroz vaqt primary'dan"""
+    replica_state['last_write'] = time.monotonic()
+
+
+def pick_replica():
+    """Ishlayotgan replica bind kaliti yoki None (primary)"""
+    if not REPLICA_URLS:
+        return None
+    now = time.monotonic()
+    if now - replica_state['last_write'] < REPLICA_STICKY_SECONDS:
+        inc_metric("db_read_sticky_primary")
+        return None
+    healthy = [
+        key for key in app.config["SQLALCHEMY_BINDS"]
+        if replica_state['down_until'].get(key, 0) <= now
+    ]
+    return random.choice(healthy) if healthy else None
+
+
+def run_read(query_func):
+    """O'qish so'rovini replica'da bajarish; xato bo'lsa primary'ga qaytish"""
+    with app.app_context():
+        bind_key = pick_replica()
+        if bind_key:
+            try:
+                with Session(db.engines[bind_key]) as session:
+                    result = query_func(session)
+                inc_metric("db_read_replica")
+                return result
+            except DBAPIError as e:
+                replica_state['down_until'][bind_key] = time.monotonic() + REPLICA_RETRY_SECONDS
+                inc_metric("db_read_replica_failed")
+                logger.warning("Replica %s error, using primary: %s", bind_key, e)
+        inc_metric("db_read_primary")
+        return query_func(db.session)
+
+
+async def send_movie_file(bot, chat_id, file_type, file_id, caption):
+    """Faylni turiga mos metod bilan yuborish"""
+    if file_type == "video":
+        await bot.send_video(chat_id=chat_id, video=file_id, caption=caption, parse_mode='HTML')
+    elif file_type == "document":
+        await bot.send_document(chat_id=chat_id, document=file_id, caption=caption, parse_mode='HTML')
+    elif file_type == "audio":
+        await bot.send_audio(chat_id=chat_id, audio=file_id, caption=caption, parse_mode='HTML')
+    elif file_type == "photo":
+        await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, parse_mode='HTML')
+
+
+def retry_after_seconds(error):
+    """RetryAfter kutish vaqti soniyalarda"""
+    if isinstance(error.retry_after, (int, float)):
+        return error.retry_after
+    return error.retry_after.total_seconds()
 
 
 def get_file_emoji(file_type):
@@ -74,27 +838,218 @@ def get_file_emoji(file_type):
     return emoji_map.get(file_type, "📁")
 
 
-def save_movie(movie_id, name, file_id, file_type, channel_id, message_id):
-    """Kinoni bazaga saqlash"""
+def extract_media(message):
+    """Xabardagi fayl: (file_id, file_unique_id, file_type, file_name) yoki None"""
+    if message.video:
+        media, file_type, file_name = message.video, "video", message.video.file_name
+    elif message.document:
+        media, file_type, file_name = message.document, "document", message.document.file_name
+    elif message.audio:
+        media, file_type, file_name = message.audio, "audio", message.audio.file_name
+    elif message.photo:
+        media, file_type, file_name = message.photo[-1], "photo", "rasm"
+    else:
+        return None
+    return media.file_id, media.file_unique_id, file_type, file_name or ""
+
+
+def save_movie(movie_id, name, file_id, file_type, channel_id, message_id, file_unique_id=None):
+    """Kinoni bazaga saqlash; saqlangan movie_id qaytariladi"""
+    row = {
+        'movie_id': movie_id,
+        'name': name,
+        'file_id': file_id,
+        'file_unique_id': file_unique_id,
+        'file_type': file_type,
+        'channel_id': channel_id,
+        'message_id': message_id,
+    }
+    return save_movies_batch([row])[0]
+
+
+def save_movies_batch(rows):
+    """Kinolarni bitta tranzaksiyada saqlash (upsert).
+
+    Bir xil file_unique_id'li kontent bitta qatorda saqlanadi: mavjud
+    qator (va uning movie_id'si) qoladi, faqat file_id yangilanadi.
+    """
+    stored_ids = []
+    changed = []
     with app.app_context():
-        existing = Movie.query.filter_by(movie_id=movie_id).first()
-        if existing:
-            existing.name = name
-            existing.file_id = file_id
-            existing.file_type = file_type
-            existing.channel_id = channel_id
-            existing.message_id = message_id
-        else:
-            movie = Movie(
-                movie_id=movie_id,
-                name=name,
-                file_id=file_id,
-                file_type=file_type,
-                channel_id=channel_id,
-                message_id=message_id
-            )
-            db.session.add(movie)
+        movie_ids = [r['movie_id'] for r in rows]
+        unique_ids = [r['file_unique_id'] for r in rows if r.get('file_unique_id')]
+        by_movie_id = {
+            m.movie_id: m for m in Movie.query.filter(Movie.movie_id.in_(movie_ids)).all()
+        }
+        by_unique_id = {
+            m.file_unique_id: m for m in Movie.query.filter(Movie.file_unique_id.in_(unique_ids)).all()
+        } if unique_ids else {}
+
+        for row in rows:
+            row['search_key'] = normalize_search_key(row['name'])
+            movie = by_movie_id.get(row['movie_id'])
+            owner = by_unique_id.get(row.get('file_unique_id'))
+
+            if owner is not None and owner is not movie:
+                # Takroriy kontent: birinchi qator qoladi
+                owner.file_id = row['file_id']
+                if movie is not None:
+                    db.session.delete(movie)
+                    del by_movie_id[movie.movie_id]
+                    changed.append((movie.movie_id, None, None, None))
+                inc_metric("dedupe_merged")
+                stored_ids.append(owner.movie_id)
+                continue
+
+            if movie is not None:
+                for field, value in row.items():
+                    setattr(movie, field, value)
+            else:
+                movie = Movie(**row)
+                db.session.add(movie)
+                by_movie_id[movie.movie_id] = movie
+            if movie.file_unique_id:
+                by_unique_id[movie.file_unique_id] = movie
+            stored_ids.append(movie.movie_id)
+            changed.append((movie.movie_id, movie.name, movie.file_type, movie.search_key))
+        notify_catalog_change()
+        db.session.commit()
+    mark_catalog_write()
+    catalog_cache.request_reload()
+    for entry in changed:
+        fuzzy_index.add(*entry)
+    return stored_ids
+
+
+def compact_duplicate_movies(batch_size=200):
+    """Aynan bir xil file_id'li eski qatorlarni birlashtirish; o'chirilganlar soni.
+
+    Boshqa bot yoki qayta forward orqali kelgan nusxalarning file_id'si
+    farq qiladi: ular faqat backfill_file_unique_ids file_unique_id'ni
+    to'ldirganda birlashadi.
+    """
+    removed = 0
+    with app.app_context():
+        while True:
+            duplicate_keys = db.session.execute(
+                db.select(Movie.file_id)
+                .group_by(Movie.file_id)
+                .having(db.func.count(Movie.id) > 1)
+                .limit(batch_size)
+            ).scalars().all()
+            if not duplicate_keys:
+                break
+
+            rows = db.session.execute(
+                db.select(Movie.id, Movie.file_id)
+                .where(Movie.file_id.in_(duplicate_keys))
+                .order_by(Movie.id)
+            ).all()
+            kept = set()
+            delete_ids = []
+            for row_id, file_id in rows:
+                if file_id in kept:
+                    delete_ids.append(row_id)
+                else:
+                    kept.add(file_id)
+
+            db.session.execute(db.delete(Movie).where(Movie.id.in_(delete_ids)))
+            notify_catalog_change()
+            db.session.commit()
+            mark_catalog_write()
+            catalog_cache.request_reload()
+            removed += len(delete_ids)
+    if removed:
+        fuzzy_index.invalidate()
+    inc_metric("dedupe_compacted", removed)
+    return removed
+
+
+def missing_unique_ids(after_id, batch_size):
+    """file_unique_id'siz qatorlar: (id, file_id)"""
+    with app.app_context():
+        return db.session.execute(
+            db.select(Movie.id, Movie.file_id)
+            .where(Movie.file_unique_id.is_(None), Movie.id > after_id)
+            .order_by(Movie.id)
+            .limit(batch_size)
+        ).all()
+
+
+def apply_unique_ids(resolved):
+    """Topilgan file_unique_id'larni yozish; egasi bor kontentning nusxasi o'chiriladi"""
+    if not resolved:
+        return 0
+    with app.app_context():
+        owners = set(db.session.execute(
+            db.select(Movie.file_unique_id)
+            .where(Movie.file_unique_id.in_([unique_id for _, unique_id in resolved]))
+        ).scalars())
+        delete_ids = []
+        for row_id, unique_id in resolved:
+            if unique_id in owners:
+                delete_ids.append(row_id)
+            else:
+                db.session.execute(db.update(Movie).where(Movie.id == row_id).values(file_unique_id=unique_id))
+                owners.add(unique_id)
+        if delete_ids:
+            db.session.execute(db.delete(Movie).where(Movie.id.in_(delete_ids)))
+        notify_catalog_change()
         db.session.commit()
+        mark_catalog_write()
+        catalog_cache.request_reload()
+    if delete_ids:
+        fuzzy_index.invalidate()
+    inc_metric("dedupe_backfill_merged", len(delete_ids))
+    return len(delete_ids)
+
+
+async def resolve_unique_id(bot, file_id):
+    """getFile orqali file_unique_id: (natija, None) yoki (None, sabab: oversize|invalid|transient)"""
+    for attempt in range(1, BACKFILL_MAX_ATTEMPTS + 1):
+        try:
+            tg_file = await bot.get_file(file_id)
+            return tg_file.file_unique_id, None
+        except RetryAfter as e:
+            # Limit tugagach aynan shu fayl qayta so'raladi
+            delay = retry_after_seconds(e)
+        except BadRequest as e:
+            return None, 'oversize' if 'too big' in str(e).lower() else 'invalid'
+        except (TimedOut, NetworkError):
+            delay = 2 ** attempt
+        except TelegramError:
+            return None, 'invalid'
+        if attempt < BACKFILL_MAX_ATTEMPTS:
+            await asyncio.sleep(delay)
+    return None, 'transient'
+
+
+async def backfill_file_unique_ids(bot, batch_size=100):
+    """Eski qatorlar uchun file_unique_id'ni getFile orqali aniqlash.
+
+    Bot API getFile faqat 20 MB gacha fayllar uchun ishlaydi; kattaroq
+    fayllar aniqlanmay qoladi. Natija: filled, merged, oversize, invalid,
+    transient hisoblari.
+    """
+    after_id = 0
+    counts = {'filled': 0, 'merged': 0, 'oversize': 0, 'invalid': 0, 'transient': 0}
+    while True:
+        rows = await asyncio.to_thread(missing_unique_ids, after_id, batch_size)
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        resolved = []
+        for row_id, file_id in rows:
+            unique_id, reason = await resolve_unique_id(bot, file_id)
+            if unique_id:
+                resolved.append((row_id, unique_id))
+            else:
+                counts[reason] += 1
+            await asyncio.sleep(1 / BACKFILL_RATE)
+        batch_merged = await asyncio.to_thread(apply_unique_ids, resolved)
+        counts['merged'] += batch_merged
+        counts['filled'] += len(resolved) - batch_merged
+    return counts
 
 
 def delete_movie_by_id(movie_id):
@@ -104,7 +1059,11 @@ def delete_movie_by_id(movie_id):
         if movie:
             name = movie.name
             db.session.delete(movie)
+            notify_catalog_change()
             db.session.commit()
+            mark_catalog_write()
+            catalog_cache.request_reload()
+            fuzzy_index.remove(movie_id)
             return name
         return None
 
@@ -116,92 +1075,714 @@ def save_admin_link(name, file_id, channel_link):
         link = AdminLink(link_id=link_id, name=name, file_id=file_id, channel_link=channel_link)
         db.session.add(link)
         db.session.commit()
+        mark_catalog_write()
         return link_id
 
 
 def get_admin_link(link_id):
     """Admin linkini bazadan olish"""
-    with app.app_context():
-        link = AdminLink.query.filter_by(link_id=link_id).first()
-        if link:
-            return link.to_dict()
-        return None
+    def query(session):
+        link = session.execute(db.select(AdminLink).filter_by(link_id=link_id)).scalar()
+        return link.to_dict() if link else None
+    return run_read(query)
 
 
 def get_movie_count():
     """Jami kinolar soni"""
-    with app.app_context():
-        return Movie.query.count()
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        return len(snapshot.movie_ids)
+    return run_read(lambda session: session.scalar(db.select(db.func.count(Movie.id))))
 
 
 def get_movies_by_type():
     """Fayl turlariga qarab kinolar soni"""
-    with app.app_context():
-        video_count = Movie.query.filter_by(file_type='video').count()
-        doc_count = Movie.query.filter_by(file_type='document').count()
-        audio_count = Movie.query.filter_by(file_type='audio').count()
-        photo_count = Movie.query.filter_by(file_type='photo').count()
-        return video_count, doc_count, audio_count, photo_count
+    def query(session):
+        stmt = db.select(Movie.file_type, db.func.count(Movie.id)).group_by(Movie.file_type)
+        return dict(session.execute(stmt).all())
+    snapshot = catalog_cache.snapshot
+    counts = snapshot.type_counts if snapshot else run_read(query)
+    return counts.get('video', 0), counts.get('document', 0), counts.get('audio', 0), counts.get('photo', 0)
 
 
+@coalesced
 def search_movies_db(query):
-    """Kinolarni qidirish"""
-    with app.app_context():
-        movies = Movie.query.filter(Movie.name.ilike(f'%{query}%')).all()
-        return [(m.movie_id, m.to_dict()) for m in movies]
+    """Kinolarni qidirish: (movie_id, name, file_type) tuple'lari"""
+    key = normalize_search_key(query)
+    if not key:
+        return []
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        return snapshot.search(key)
+    stmt = (
+        db.select(Movie.movie_id, Movie.name, Movie.file_type)
+        .outerjoin(MovieStat, MovieStat.movie_id == Movie.movie_id)
+        .where(Movie.search_key.contains(key, autoescape=True))
+        .order_by(db.func.coalesce(MovieStat.trend_score, 0).desc(), Movie.id)
+    )
+    return run_read(lambda session: [tuple(row) for row in session.execute(stmt)])
 
 
+@coalesced
 def get_movie_by_id(movie_id):
     """ID bo'yicha kinoni olish"""
-    with app.app_context():
-        movie = Movie.query.filter_by(movie_id=movie_id).first()
-        if movie:
-            return movie.to_dict()
-        return None
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        return snapshot.get(movie_id)
+
+    def query(session):
+        movie = session.execute(db.select(Movie).filter_by(movie_id=movie_id)).scalar()
+        return movie.to_dict() if movie else None
+    return run_read(query)
 
 
 def get_all_movies():
-    """Barcha kinolarni olish"""
-    with app.app_context():
-        movies = Movie.query.order_by(Movie.created_at.desc()).all()
-        return [(m.movie_id, m.to_dict()) for m in movies]
+    """Barcha kinolarni olish: (movie_id, name, file_type) tuple'lari"""
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        return list(zip(snapshot.movie_ids, snapshot.names, snapshot.file_types))
+    stmt = (
+        db.select(Movie.movie_id, Movie.name, Movie.file_type)
+        .order_by(Movie.created_at.desc())
+    )
+    return run_read(lambda session: [tuple(row) for row in session.execute(stmt)])
 
 
 def get_random_movie():
     """Tasodifiy kinoni olish"""
-    with app.app_context():
-        count = Movie.query.count()
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        if not snapshot.movie_ids:
+            return None, None
+        movie_id = random.choice(snapshot.movie_ids)
+        return movie_id, snapshot.get(movie_id)
+
+    def query(session):
+        count = session.scalar(db.select(db.func.count(Movie.id)))
         if count == 0:
             return None, None
         offset = random.randint(0, count - 1)
-        movie = Movie.query.offset(offset).first()
+        movie = session.execute(db.select(Movie).offset(offset).limit(1)).scalar()
         if movie:
             return movie.movie_id, movie.to_dict()
         return None, None
+    return run_read(query)
+
+
+def notify_catalog_change():
+    """catalog_version'ni katalog yozuvi bilan bitta tranzaksiyada oshirish (commit'dan oldin chaqiriladi).
+
+    PostgreSQL'da NOTIFY ham shu tranzaksiya commit bo'lganda yetkaziladi.
+    """
+    if not catalog_cache.enabled:
+        return
+    result = db.session.execute(db.update(CatalogVersion).values(version=CatalogVersion.version + 1))
+    if result.rowcount == 0:
+        db.session.add(CatalogVersion(version=1))
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('NOTIFY catalog_changed'))
+
+
+class CatalogSnapshot:
+    """Katalogning ustunli (columnar) nusxasi: har bir maydon alohida tuple"""
+
+    __slots__ = (
+        'version', 'movie_ids', 'names', 'file_types', 'file_ids', 'channel_ids',
+        'message_ids', 'search_keys', 'positions', 'search_order', 'type_counts'
+    )
+
+    def __init__(self, version, rows):
+        self.version = version
+        columns = tuple(zip(*rows)) if rows else ((),) * 8
+        (self.movie_ids, self.names, self.file_types, self.file_ids,
+         self.channel_ids, self.message_ids, self.search_keys, trend_scores) = columns
+        self.positions = {movie_id: i for i, movie_id in enumerate(self.movie_ids)}
+        # Qidiruv natijalari DB'dagidek trend bo'yicha tartiblanadi
+        self.search_order = tuple(sorted(range(len(rows)), key=lambda i: -(trend_scores[i] or 0)))
+        self.type_counts = {}
+        for file_type in self.file_types:
+            self.type_counts[file_type] = self.type_counts.get(file_type, 0) + 1
+
+    def get(self, movie_id):
+        i = self.positions.get(movie_id)
+        if i is None:
+            return None
+        return {
+            'name': self.names[i],
+            'file_id': self.file_ids[i],
+            'file_type': self.file_types[i],
+            'channel_id': self.channel_ids[i],
+            'message_id': self.message_ids[i]
+        }
+
+    def search(self, key):
+        search_keys = self.search_keys
+        return [
+            (self.movie_ids[i], self.names[i], self.file_types[i])
+            for i in self.search_order
+            if key in (search_keys[i] or '')
+        ]
+
+
+class CatalogCache:
+    """Katalogni xotirada saqlash va o'zgarishlarni kuzatish (LISTEN yoki polling)"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._snapshot = None
+        self.lock = threading.Lock()
+        self.listen_conn = None
+        self.wake = threading.Event()
+        self.request_lock = threading.Lock()
+        self.requested = 0  # shu worker'dagi yozuvlar soni
+        self.loaded = 0  # snapshot qaysi yozuvgacha yangilangan
+
+    @property
+    def snapshot(self):
+        """Joriy nusxa; shu worker yozgan o'zgarish hali yuklanmagan bo'lsa None (o'qish DB'dan)"""
+        if self.loaded < self.requested:
+            return None
+        return self._snapshot
+
+    def request_reload(self):
+        """Katalog yozildi: watcher thread'ini uyg'otish (bot loop bloklanmaydi)"""
+        if not self.enabled:
+            return
+        with self.request_lock:
+            self.requested += 1
+        self.wake.set()
+
+    def current_version(self):
+        with app.app_context():
+            return db.session.execute(db.select(CatalogVersion.version).limit(1)).scalar() or 0
+
+    def reload(self):
+        """Katalogni primary'dan to'liq yuklash va atomik almashtirish"""
+        def load():
+            with self.lock:
+                requested = self.requested
+                version = self.current_version()
+                stmt = (
+                    db.select(
+                        Movie.movie_id, Movie.name, Movie.file_type, Movie.file_id,
+                        Movie.channel_id, Movie.message_id, Movie.search_key, MovieStat.trend_score
+                    )
+                    .outerjoin(MovieStat, MovieStat.movie_id == Movie.movie_id)
+                    .order_by(Movie.created_at.desc())
+                )
+                with app.app_context():
+                    rows = [tuple(row) for row in db.session.execute(stmt)]
+                self._snapshot = CatalogSnapshot(version, rows)
+                self.loaded = requested
+            return [(row[0], row[1], row[2], row[6]) for row in rows]
+
+        # Fuzzy indeks o'zgarishlarni SELECT'dan oldin yig'a boshlaydi
+        fuzzy_index.rebuild(load)
+        inc_metric("catalog_reloads")
+
+    def _listen(self):
+        """PostgreSQL LISTEN ulanishi; boshqa bazalarda None"""
+        if self.listen_conn is None:
+            with app.app_context():
+                engine = db.engine
+            if engine.dialect.name != 'postgresql':
+                return None
+            self.listen_conn = engine.raw_connection()
+            conn = self.listen_conn.driver_connection
+            conn.autocommit = True
+            conn.cursor().execute('LISTEN catalog_changed')
+        return self.listen_conn.driver_connection
+
+    def _wait_for_change(self):
+        if self.wake.is_set():
+            return
+        conn = self._listen()
+        if conn is None:
+            self.wake.wait(CATALOG_POLL_INTERVAL)
+            return
+        # NOTIFY kelguncha yoki polling oralig'i tugaguncha kutish
+        if select.select([conn], [], [], CATALOG_POLL_INTERVAL)[0]:
+            conn.poll()
+            conn.notifies.clear()
+
+    def watch(self):
+        while True:
+            try:
+                self.wake.clear()
+                if (self._snapshot is None or self.loaded < self.requested
+                        or self.current_version() != self._snapshot.version):
+                    self.reload()
+                self._wait_for_change()
+            except Exception as e:
+                logger.warning("Catalog watcher error: %s", e)
+                if self.listen_conn is not None:
+                    self.listen_conn.invalidate()
+                    self.listen_conn = None
+                time.sleep(CATALOG_POLL_INTERVAL)
+
+    def start(self):
+        threading.Thread(target=self.watch, daemon=True, name="catalog-watcher").start()
+
+
+catalog_cache = CatalogCache(CATALOG_CACHE)
+register_gauge("catalog_entries", lambda: len(catalog_cache._snapshot.movie_ids) if catalog_cache._snapshot else 0)
+
+
+def trigrams(key):
+    """pg_trgm uslubidagi trigrammalar (har so'z bo'sh joy bilan o'ralgan)"""
+    grams = set()
+    for word in key.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class FuzzyIndex:
+    """Kino nomlari bo'yicha trigram indeksi ("balki shuni nazarda tutgandirsiz")"""
+
+    def __init__(self):
+        self.postings = {}  # trigram -> {movie_id}
+        self.entries = {}  # movie_id -> (name, file_type, trigrams)
+        self.built_at = None
+        self.stale = True
+        self.pending = None  # qayta qurish paytida kelgan o'zgarishlar
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+
+    @staticmethod
+    def _apply(postings, entries, movie_id, name, file_type, search_key):
+        """Kinoni indeksga yozish (name None bo'lsa o'chirish)"""
+        entry = entries.pop(movie_id, None)
+        if entry:
+            for gram in entry[2]:
+                posting = postings.get(gram)
+                if posting:
+                    posting.discard(movie_id)
+                    if not posting:
+                        del postings[gram]
+        if name is None:
+            return
+        grams = trigrams(search_key if search_key is not None else normalize_search_key(name))
+        entries[movie_id] = (name, file_type, grams)
+        for gram in grams:
+            postings.setdefault(gram, set()).add(movie_id)
+
+    def add(self, movie_id, name, file_type, search_key=None):
+        """Bitta kinoni qo'shish/yangilash (name None bo'lsa o'chirish)"""
+        change = (movie_id, name, file_type, search_key)
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(change)
+            if self.built_at is not None:
+                self._apply(self.postings, self.entries, *change)
+
+    def remove(self, movie_id):
+        self.add(movie_id, None, None)
+
+    def invalidate(self):
+        """Keyingi miss'da fonda qayta qurish; ungacha eski indeks ishlaydi"""
+        self.stale = True
+
+    def _rebuild(self, loader):
+        # pending o'qishdan oldin ochiladi: o'qish va almashtirish orasidagi o'zgarishlar ham yo'qolmaydi
+        with self.lock:
+            self.pending = []
+        postings, entries = {}, {}
+        try:
+            for row in loader():
+                self._apply(postings, entries, *row)
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+        with self.lock:
+            for change in self.pending:
+                self._apply(postings, entries, *change)
+            self.postings, self.entries = postings, entries
+            self.pending = None
+            self.built_at = time.monotonic()
+            self.stale = False
+        inc_metric("fuzzy_index_rebuilds")
+
+    def rebuild(self, loader):
+        """loader() -> (movie_id, name, file_type, search_key) qatorlari; yangi indeks tayyor bo'lgach almashtiriladi"""
+        with self.rebuild_lock:
+            self._rebuild(loader)
+
+    def refresh_async(self, loader):
+        """Fonda qayta qurish; allaqachon qurilayotgan bo'lsa hech narsa qilmaydi"""
+        if not self.rebuild_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._rebuild(loader)
+            except Exception as e:
+                logger.warning("Fuzzy index rebuild error: %s", e)
+            finally:
+                self.rebuild_lock.release()
+
+        threading.Thread(target=run, daemon=True, name="fuzzy-index").start()
+
+    def is_stale(self):
+        if self.stale or self.built_at is None:
+            return True
+        return not catalog_cache.enabled and time.monotonic() - self.built_at > FUZZY_REBUILD_INTERVAL
+
+    def suggest(self, key, limit, min_score, budget_ms):
+        """Eng o'xshash kinolar: [(movie_id, name, file_type)]"""
+        query_grams = trigrams(key)
+        if not query_grams:
+            return []
+        deadline = time.perf_counter() + budget_ms / 1000
+        shared = {}
+        with self.lock:
+            # Kam uchraydigan trigrammalar birinchi: budjet tugasa ham eng foydalilari hisoblangan bo'ladi
+            postings = sorted((self.postings.get(gram, ()) for gram in query_grams), key=len)
+            for posting in postings:
+                for movie_id in posting:
+                    shared[movie_id] = shared.get(movie_id, 0) + 1
+                if time.perf_counter() > deadline:
+                    inc_metric("fuzzy_budget_exceeded")
+                    break
+            scored = (
+                (2 * count / (len(query_grams) + len(self.entries[movie_id][2])), movie_id)
+                for movie_id, count in shared.items()
+            )
+            best = heapq.nlargest(limit, scored)
+            return [
+                (movie_id, self.entries[movie_id][0], self.entries[movie_id][1])
+                for score, movie_id in best
+                if score >= min_score
+            ]
+
+
+fuzzy_index = FuzzyIndex()
+
+
+def load_fuzzy_rows():
+    """Indeks uchun qatorlar: (movie_id, name, file_type, search_key)"""
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        return list(zip(snapshot.movie_ids, snapshot.names, snapshot.file_types, snapshot.search_keys))
+    return run_read(lambda session: [
+        tuple(row) for row in session.execute(
+            db.select(Movie.movie_id, Movie.name, Movie.file_type, Movie.search_key)
+        )
+    ])
+
+
+def suggest_movies(query):
+    """Hech narsa topilmaganda o'xshash nomlarni taklif qilish"""
+    key = normalize_search_key(query)
+    if not key:
+        return []
+    if fuzzy_index.is_stale():
+        # So'rov yo'lida qayta qurilmaydi: fonda quriladi, hozircha eski indeks
+        fuzzy_index.refresh_async(load_fuzzy_rows)
+    return fuzzy_index.suggest(key, FUZZY_LIMIT, FUZZY_MIN_SCORE, FUZZY_BUDGET_MS)
+
+
+class BatchCounter:
+    """Hisoblagichlar xotirada yig'iladi va partiyalab bazaga yoziladi"""
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, key, count=1):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def merge(self, counts):
+        """Yozilmay qolgan hisoblarni qaytarish"""
+        with self.lock:
+            for key, count in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + count
+
+    def peek(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def drain(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+
+popularity = BatchCounter()
+top_cache = {'expires_at': 0.0, 'items': []}
+
+
+def trend_point(count, timestamp):
+    """count ta so'rovning timestamp vaqtidagi log-ballari"""
+    return math.log(count) + timestamp * math.log(2) / TRENDING_HALF_LIFE
+
+
+def log_add(a, b):
+    """ln(e^a + e^b) toshib ketmasdan"""
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def flush_popularity(counts):
+    """Yig'ilgan hisoblagichlarni movie_stats jadvaliga qo'shish"""
+    now = datetime.utcnow()
+    timestamp = time.time()
+    with app.app_context():
+        stats = {
+            s.movie_id: s for s in MovieStat.query.filter(MovieStat.movie_id.in_(list(counts))).all()
+        }
+        for movie_id, count in counts.items():
+            point = trend_point(count, timestamp)
+            stat = stats.get(movie_id)
+            if stat:
+                stat.request_count += count
+                stat.trend_score = log_add(stat.trend_score, point)
+                stat.last_requested = now
+            else:
+                db.session.add(MovieStat(
+                    movie_id=movie_id,
+                    request_count=count,
+                    trend_score=point,
+                    last_requested=now
+                ))
+        db.session.commit()
+
+
+async def flush_popularity_buffer():
+    """Yig'ilgan hisoblarni yozish; xato bo'lsa keyingi safarga qaytarish"""
+    counts = popularity.drain()
+    if not counts:
+        return
+    try:
+        await asyncio.to_thread(flush_popularity, counts)
+        inc_metric("popularity_flushed", sum(counts.values()))
+    except Exception as e:
+        logger.error("Popularity flush error: %s", e)
+        popularity.merge(counts)
+
+
+async def popularity_flush_loop():
+    """Hisoblagichlarni muntazam bazaga yozish"""
+    while True:
+        await asyncio.sleep(POPULARITY_FLUSH_INTERVAL)
+        await flush_popularity_buffer()
+
+
+def get_top_movies():
+    """Trenddagi kinolar (keshlangan): (movie_id, name, file_type, request_count)"""
+    now = time.monotonic()
+    if top_cache['expires_at'] > now:
+        return top_cache['items']
+    stmt = (
+        db.select(Movie.movie_id, Movie.name, Movie.file_type, MovieStat.request_count)
+        .join(MovieStat, MovieStat.movie_id == Movie.movie_id)
+        .order_by(MovieStat.trend_score.desc())
+        .limit(TOP_LIMIT)
+    )
+    items = run_read(lambda session: [tuple(row) for row in session.execute(stmt)])
+    top_cache['items'] = items
+    top_cache['expires_at'] = now + TOP_CACHE_TTL
+    return items
+
+
+activity = BatchCounter()
+
+
+def record_activity(metric, day=None):
+    """Kunlik rollup hisoblagichini oshirish (xotirada)"""
+    day = day or datetime.utcnow().date()
+    activity.record((day, metric))
+
+
+def record_user_activity(previous_seen, now):
+    """Foydalanuvchi kun/hafta/oyda birinchi marta ko'rinsa DAU/WAU/MAU ga qo'shish"""
+    today = now.date()
+    week_start = today - timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    previous_day = previous_seen.date() if previous_seen else None
+
+    if previous_day is None or previous_day < today:
+        record_activity('active_users', today)
+    if previous_day is None or previous_day < week_start:
+        record_activity('weekly_active_users', week_start)
+    if previous_day is None or previous_day < month_start:
+        record_activity('monthly_active_users', month_start)
+
+
+def flush_rollups(counts):
+    """Yig'ilgan (kun, metrika) hisoblarini daily_stats jadvaliga qo'shish"""
+    days = {day for day, _ in counts}
+    with app.app_context():
+        existing = {
+            (row.day, row.metric): row
+            for row in DailyStat.query.filter(DailyStat.day.in_(days)).all()
+        }
+        for (day, metric), count in counts.items():
+            row = existing.get((day, metric))
+            if row:
+                row.value += count
+            else:
+                db.session.add(DailyStat(day=day, metric=metric, value=count))
+        db.session.commit()
+
+
+async def flush_rollup_buffer():
+    """Rollup hisoblarini yozish; xato bo'lsa keyingi safarga qaytarish"""
+    counts = activity.drain()
+    if not counts:
+        return
+    try:
+        await asyncio.to_thread(flush_rollups, counts)
+    except Exception as e:
+        logger.error("Rollup flush error: %s", e)
+        activity.merge(counts)
+
+
+async def rollup_flush_loop():
+    """Rollup hisoblagichlarini muntazam bazaga yozish"""
+    while True:
+        await asyncio.sleep(ROLLUP_FLUSH_INTERVAL)
+        await flush_rollup_buffer()
+
+
+def get_activity_summary(days=STATS_DAYS):
+    """Oxirgi kunlar bo'yicha rollup'lar: {(kun, metrika): qiymat}"""
+    today = datetime.utcnow().date()
+    since = min(today - timedelta(days=days - 1), today.replace(day=1))
+
+    def query(session):
+        stmt = db.select(DailyStat.day, DailyStat.metric, DailyStat.value).where(DailyStat.day >= since)
+        return {(day, metric): value for day, metric, value in session.execute(stmt)}
+
+    summary = run_read(query)
+    # Hali bazaga yozilmagan hisoblar ham qo'shiladi
+    for key, count in activity.peek().items():
+        if key[0] >= since:
+            summary[key] = summary.get(key, 0) + count
+    return summary
 
 
 def track_user(user_id, first_name=None, username=None):
     """Foydalanuvchini kuzatish"""
+    now = datetime.utcnow()
     with app.app_context():
         existing = User.query.filter_by(user_id=str(user_id)).first()
         if existing:
-            existing.last_seen = datetime.utcnow()
+            previous_seen = existing.last_seen
+            existing.last_seen = now
             existing.interaction_count += 1
         else:
-            user = User(
-                user_id=str(user_id),
-                first_name=first_name,
-                username=username,
-                interaction_count=1
-            )
+            archived = ArchivedUser.query.filter_by(user_id=str(user_id)).first()
+            if archived:
+                # Arxivlangan foydalanuvchi qaytdi: tarixini tiklaymiz
+                previous_seen = archived.last_seen
+                user = User(
+                    user_id=archived.user_id,
+                    first_name=first_name or archived.first_name,
+                    username=username or archived.username,
+                    interaction_count=archived.interaction_count + 1,
+                    last_seen=now
+                )
+                db.session.delete(archived)
+            else:
+                previous_seen = None
+                user = User(
+                    user_id=str(user_id),
+                    first_name=first_name,
+                    username=username,
+                    interaction_count=1
+                )
+                record_activity('new_users', now.date())
             db.session.add(user)
         db.session.commit()
+    record_user_activity(previous_seen, now)
 
 
-def get_user_stats():
-    """Foydalanuvchilar statistikasi"""
+def archive_inactive_users(cutoff, batch_size=MAINTENANCE_BATCH_SIZE):
+    """cutoff'dan beri ko'rinmagan foydalanuvchilarni users_archive'ga ko'chirish"""
+    moved = 0
+    now = datetime.utcnow()
     with app.app_context():
-        return User.query.count()
+        while True:
+            users = (
+                User.query.filter(User.last_seen < cutoff)
+                .order_by(User.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not users:
+                break
+            for user in users:
+                db.session.add(ArchivedUser(
+                    user_id=user.user_id,
+                    first_name=user.first_name,
+                    username=user.username,
+                    interaction_count=user.interaction_count,
+                    last_seen=user.last_seen,
+                    archived_at=now
+                ))
+                db.session.delete(user)
+            db.session.commit()
+            moved += len(users)
+    return moved
+
+
+def prune_admin_links(cutoff, batch_size=MAINTENANCE_BATCH_SIZE):
+    """cutoff'dan eski admin linklarini o'chirish"""
+    removed = 0
+    with app.app_context():
+        while True:
+            ids = db.session.execute(
+                db.select(AdminLink.id).where(AdminLink.created_at < cutoff).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            db.session.execute(db.delete(AdminLink).where(AdminLink.id.in_(ids)))
+            db.session.commit()
+            removed += len(ids)
+    return removed
+
+
+def vacuum_tables(*tables):
+    """PostgreSQL'da o'chirilgan qatorlar joyini qaytarish"""
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            return
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in tables:
+                conn.execute(db.text(f'VACUUM (ANALYZE) {table}'))
+
+
+def run_maintenance():
+    """Arxivlash va tozalash; (ko'chirilgan, o'chirilgan) qaytaradi"""
+    now = datetime.utcnow()
+    archived = archive_inactive_users(now - timedelta(days=ARCHIVE_AFTER_DAYS))
+    pruned = prune_admin_links(now - timedelta(days=ADMIN_LINK_RETENTION_DAYS))
+    if archived or pruned:
+        try:
+            vacuum_tables('users', 'admin_links')
+        except DBAPIError as e:
+            logger.warning("Vacuum notice: %s", e)
+    inc_metric("maintenance_users_archived", archived)
+    inc_metric("maintenance_admin_links_pruned", pruned)
+    logger.info("Maintenance: %s users archived, %s admin links pruned", archived, pruned)
+    return archived, pruned
+
+
+def get_user_stats():
+    """Jami foydalanuvchilar (faol + arxivlangan)"""
+    def query(session):
+        active = session.scalar(db.select(db.func.count(User.id)))
+        archived = session.scalar(db.select(db.func.count(ArchivedUser.id)))
+        return active + archived
+    return run_read(query)
+
+
+def get_active_user_count():
+    """Faol (arxivlanmagan) foydalanuvchilar soni"""
+    return run_read(lambda session: session.scalar(db.select(db.func.count(User.id))))
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -240,6 +1821,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("📋 Barcha Kinolar", callback_data="cmd_list"),
             InlineKeyboardButton("🎲 Tasodifiy", callback_data="cmd_random")
         ],
+        [InlineKeyboardButton("🔥 Top kinolar", callback_data="cmd_top")],
         [
             InlineKeyboardButton("ℹ️ Bot haqida", callback_data="cmd_about"),
             InlineKeyboardButton("📖 Yordam", callback_data="cmd_help")
@@ -264,7 +1846,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "│ 📋 /list - Kinolar ro'yxati   │\n"
             "│ 🗑 /delete ID - O'chirish     │\n"
             "│ 🔗 /createlink - Link qilish  │\n"
-            "│ 📨 /link - Link post qilish   │\n\n"
+            "│ 📨 /link - Link post qilish   │\n"
+            "│ 🧹 /compact - Dublikatlar     │\n"
+            "│ 🔁 /replay N - Qayta yuborish │\n"
+            "│ 🧹 /maintenance - Arxivlash   │\n"
+            "│ ⏱ /profile 10 cpu - Profil    │\n\n"
             "📥 <b>KINO QO'SHISH:</b>\n"
             "├ Kanaldan video/fayl forward qiling\n"
             "├ Caption = Kino nomi\n"
@@ -283,6 +1869,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "├ /start - Bosh sahifa\n"
             "├ /list - To'liq ro'yxat\n"
             "├ /random - Tasodifiy kino\n"
+            "├ /top - Top kinolar\n"
             "└ /about - Bot haqida\n\n"
             "🍿 <i>Yaxshi tomosha!</i>"
         )
@@ -339,19 +1926,47 @@ async def random_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caption = f"🎲 <b>TASODIFIY KINO</b>\n\n{emoji} <b>{movie_name}</b>\n\n💎 <i>Yana birini olish: /random</i>"
 
     try:
-        if file_type == "video":
-            await context.bot.send_video(chat_id=update.effective_chat.id, video=file_id, caption=caption, parse_mode='HTML')
-        elif file_type == "document":
-            await context.bot.send_document(chat_id=update.effective_chat.id, document=file_id, caption=caption, parse_mode='HTML')
-        elif file_type == "audio":
-            await context.bot.send_audio(chat_id=update.effective_chat.id, audio=file_id, caption=caption, parse_mode='HTML')
-        elif file_type == "photo":
-            await context.bot.send_photo(chat_id=update.effective_chat.id, photo=file_id, caption=caption, parse_mode='HTML')
+        await send_movie_file(context.bot, update.effective_chat.id, file_type, file_id, caption)
+        popularity.record(movie_id)
+        record_activity('downloads')
     except Exception as e:
-        logger.error(f"Faylni yuborishda xato: {e}")
+        logger.error("Faylni yuborishda xato: %s", e)
+        dead_letters.add("send", {
+            'chat_id': update.effective_chat.id,
+            'file_type': file_type,
+            'file_id': file_id,
+            'caption': caption,
+        }, e)
         await update.message.reply_text("❌ <b>Xatolik!</b>\n\nFaylni yuborishda muammo. /random qayta urinib ko'ring.", parse_mode='HTML')
 
 
+def build_top_message():
+    """Top ro'yxat matni va tugmalari; bo'sh bo'lsa (None, None)"""
+    movies = get_top_movies()
+    if not movies:
+        return None, None
+
+    keyboard = []
+    for movie_id, name, file_type, request_count in movies:
+        emoji = get_file_emoji(file_type)
+        keyboard.append([InlineKeyboardButton(f"{emoji} {name[:40]} · {request_count}", callback_data=f"get_{movie_id}")])
+    keyboard.append([InlineKeyboardButton("🏠 Bosh sahifa", callback_data="cmd_start")])
+
+    top_text = f"🔥 <b>TOP / TRENDDAGI KINOLAR</b>\n\n━━━━━━━━━━━━━━━━━━━━\n📊 Eng ko'p so'ralgan <b>{len(movies)}</b> ta\n━━━━━━━━━━━━━━━━━━━━\n\n👇 Kinoni tanlang:"
+    return top_text, InlineKeyboardMarkup(keyboard)
+
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Top kinolar buyrug'i"""
+    top_text, reply_markup = await asyncio.to_thread(build_top_message)
+
+    if not top_text:
+        await update.message.reply_text("📭 <b>Hozircha top ro'yxat bo'sh</b>\n\nKinolarni yuklab oling, ro'yxat shakllanadi.", parse_mode='HTML')
+        return
+
+    await update.message.reply_text(top_text, reply_markup=reply_markup, parse_mode='HTML')
+
+
 async def list_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Kinolar ro'yxati buyrug'i"""
     movies = get_all_movies()
@@ -367,9 +1982,9 @@ async def list_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     page_results = movies[start_idx:end_idx]
 
     keyboard = []
-    for movie_id, movie_data in page_results:
-        emoji = get_file_emoji(movie_data.get('file_type', 'video'))
-        keyboard.append([InlineKeyboardButton(f"{emoji} {movie_data['name'][:45]}", callback_data=f"get_{movie_id}")])
+    for movie_id, name, file_type in page_results:
+        emoji = get_file_emoji(file_type)
+        keyboard.append([InlineKeyboardButton(f"{emoji} {name[:45]}", callback_data=f"get_{movie_id}")])
 
     if end_idx < total:
         keyboard.append([InlineKeyboardButton(f"Keyingi ({total - end_idx}) ▶️", callback_data=f"list_{page + 1}")])
@@ -389,6 +2004,20 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     total = get_movie_count()
     video_count, doc_count, audio_count, photo_count = get_movies_by_type()
     total_users = get_user_stats()
+    summary = await asyncio.to_thread(get_activity_summary)
+
+    today = datetime.utcnow().date()
+    week_start = today - timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    daily_lines = ""
+    for offset in range(STATS_DAYS):
+        day = today - timedelta(days=offset)
+        daily_lines += (
+            f"│ {day.strftime('%d.%m')}  👤 {summary.get((day, 'active_users'), 0)}"
+            f"  🆕 {summary.get((day, 'new_users'), 0)}"
+            f"  🔍 {summary.get((day, 'searches'), 0)}"
+            f"  📥 {summary.get((day, 'downloads'), 0)}\n"
+        )
 
     stats_text = (
         "╔══════════════════════════════╗\n"
@@ -405,7 +2034,15 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👥 <b>FOYDALANUVCHI MA'LUMOTLARI</b>\n"
         "┌─────────────────────────────┐\n"
         f"│  👤 Jami: <b>{total_users}</b> ta odam      │\n"
+        f"│  📅 Bugun (DAU): <b>{summary.get((today, 'active_users'), 0)}</b>\n"
+        f"│  🗓 Hafta (WAU): <b>{summary.get((week_start, 'weekly_active_users'), 0)}</b>\n"
+        f"│  📆 Oy (MAU): <b>{summary.get((month_start, 'monthly_active_users'), 0)}</b>\n"
         "└─────────────────────────────┘\n\n"
+        f"📈 <b>OXIRGI {STATS_DAYS} KUN</b>\n"
+        "┌─────────────────────────────┐\n"
+        f"{daily_lines}"
+        "└─────────────────────────────┘\n"
+        "<i>👤 faol · 🆕 yangi · 🔍 qidiruv · 📥 yuklash</i>\n\n"
         "💎 <i>Premium Kino Bot v3.0</i>"
     )
 
@@ -431,6 +2068,42 @@ async def delete_movie(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Kino topilmadi.", parse_mode='HTML')
 
 
+async def compact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Takroriy kinolarni tozalash (faqat admin)"""
+    user_id = str(update.effective_user.id)
+    if user_id != ADMIN_ID:
+        return
+
+    await update.message.reply_text(
+        "🧹 Takroriy kinolar tozalanmoqda...\n\n"
+        "<i>file_unique_id'siz qatorlar getFile orqali tekshiriladi (faqat 20 MB gacha fayllar), "
+        "qolganlari faqat file_id aynan bir xil bo'lsa birlashtiriladi.</i>",
+        parse_mode='HTML'
+    )
+    context.application.create_task(run_compact(context.bot, update.effective_chat.id))
+
+
+async def run_compact(bot, chat_id):
+    """Fonda tozalash va natijani adminga yuborish"""
+    counts = await backfill_file_unique_ids(bot)
+    removed = await asyncio.to_thread(compact_duplicate_movies)
+    total = await asyncio.to_thread(get_movie_count)
+    await bot.send_message(
+        chat_id=chat_id,
+        text=(
+            f"✅ <b>Tozalandi!</b>\n\n"
+            f"🔗 file_unique_id bo'yicha birlashtirildi: <b>{counts['merged']}</b> ta\n"
+            f"🗑 Bir xil file_id bo'yicha o'chirildi: <b>{removed}</b> ta\n"
+            f"➕ file_unique_id to'ldirildi: <b>{counts['filled']}</b> ta\n"
+            f"⚠️ Aniqlanmadi (20 MB dan katta): <b>{counts['oversize']}</b> ta\n"
+            f"❌ Yaroqsiz file_id: <b>{counts['invalid']}</b> ta\n"
+            f"⏳ Limit/tarmoq xatosi (keyingi /compact'da): <b>{counts['transient']}</b> ta\n"
+            f"📊 Qoldi: <b>{total}</b> ta"
+        ),
+        parse_mode='HTML'
+    )
+
+
 async def handle_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Kanaldan forward qilingan kontentni qabul qilish"""
     user_id = str(update.effective_user.id)
@@ -458,36 +2131,15 @@ async def handle_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await message.reply_text("⚠️ <b>Xato!</b>\n\nIltimos, kanaldan forward qiling.", parse_mode='HTML')
         return
 
-    file_id = None
-    file_type = None
-    file_emoji = ""
-    caption = message.caption or ""
-    file_name = ""
-
-    if message.video:
-        file_id = message.video.file_id
-        file_type = "video"
-        file_emoji = "🎬"
-        file_name = message.video.file_name or ""
-    elif message.document:
-        file_id = message.document.file_id
-        file_type = "document"
-        file_emoji = "📄"
-        file_name = message.document.file_name or ""
-    elif message.audio:
-        file_id = message.audio.file_id
-        file_type = "audio"
-        file_emoji = "🎵"
-        file_name = message.audio.file_name or ""
-    elif message.photo:
-        file_id = message.photo[-1].file_id
-        file_type = "photo"
-        file_emoji = "📸"
-        file_name = "rasm"
-    else:
+    media = extract_media(message)
+    if not media:
         await message.reply_text("⚠️ <b>Xato!</b>\n\nFaqat video, dokument, audio yoki rasm qabul qilinadi.", parse_mode='HTML')
         return
 
+    file_id, file_unique_id, file_type, file_name = media
+    file_emoji = get_file_emoji(file_type)
+    caption = message.caption or ""
+
     movie_name = caption if caption else file_name
     if not movie_name:
         await message.reply_text("⚠️ <b>Xato!</b>\n\nKino nomi topilmadi.\nCaption yoki fayl nomini tekshiring.", parse_mode='HTML')
@@ -495,10 +2147,11 @@ async def handle_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     movie_name = movie_name.strip()
     if message_id is None:
-        message_id = hash(f"{channel_id}_{file_id}")
+        # hash() har jarayonda boshqacha; file_unique_id esa doimiy
+        message_id = file_unique_id
 
     movie_id = f"{channel_id}_{message_id}"
-    save_movie(movie_id, movie_name, file_id, file_type, channel_id, str(message_id))
+    movie_id = save_movie(movie_id, movie_name, file_id, file_type, channel_id, str(message_id), file_unique_id)
     
     total = get_movie_count()
     
@@ -510,9 +2163,12 @@ async def handle_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     if file_type == "photo":
-        context.user_data['waiting_for_photo_link'] = True
-        context.user_data['photo_name'] = movie_name
-        context.user_data['photo_file_id'] = file_id
+        conversation_state.update(
+            user_id,
+            waiting_for_photo_link=True,
+            photo_name=movie_name,
+            photo_file_id=file_id
+        )
         success_text += f"\n━━━━━━━━━━━━━━━━━━━━\n\n📊 Jami kinolar: <b>{total}</b>\n\n🔗 <b>Kanal linkini yubor:</b>\n<i>Misol: https://t.me/mychannel/123</i>"
     else:
         success_text += f"\n━━━━━━━━━━━━━━━━━━━━\n\n📊 Jami kinolar: <b>{total}</b>"
@@ -520,6 +2176,202 @@ async def handle_forward(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await message.reply_text(success_text, parse_mode='HTML')
 
 
+ingest_buffer = {}
+ingest_lock = asyncio.Lock()
+
+
+async def channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Manba kanallardagi yangi/tahrirlangan postlarni avtomatik qabul qilish"""
+    message = update.channel_post or update.edited_channel_post
+    media = extract_media(message)
+    if not media:
+        return
+
+    file_id, file_unique_id, file_type, file_name = media
+    movie_name = (message.caption or file_name).strip()
+    if not movie_name:
+        return
+
+    channel_id = str(message.chat.id)
+    movie_id = f"{channel_id}_{message.message_id}"
+    # Bir partiyada bitta fayl faqat bir marta: keyingi post/tahrir oldingisini almashtiradi
+    for key, row in list(ingest_buffer.items()):
+        if row['file_unique_id'] == file_unique_id and key != movie_id:
+            del ingest_buffer[key]
+    ingest_buffer[movie_id] = {
+        'movie_id': movie_id,
+        'name': movie_name,
+        'file_id': file_id,
+        'file_unique_id': file_unique_id,
+        'file_type': file_type,
+        'channel_id': channel_id,
+        'message_id': str(message.message_id),
+    }
+    inc_metric("ingest_buffered")
+
+    if len(ingest_buffer) >= INGEST_BATCH_SIZE:
+        await flush_ingest_buffer()
+
+
+async def flush_ingest_buffer():
+    """Buferdagi postlarni bazaga yozish"""
+    async with ingest_lock:
+        if not ingest_buffer:
+            return
+        rows = list(ingest_buffer.values())
+        ingest_buffer.clear()
+        try:
+            await asyncio.to_thread(save_movies_batch, rows)
+            inc_metric("ingest_flushed", len(rows))
+        except Exception as e:
+            inc_metric("ingest_failed", len(rows))
+            logger.error("Ingest flush error: %s", e)
+            # Keyingi flush'da qayta urinish; shu orada kelgan yangi postlar ustun
+            pending = {row['movie_id']: row for row in rows}
+            pending.update(ingest_buffer)
+            ingest_buffer.clear()
+            ingest_buffer.update(pending)
+
+
+async def ingest_flush_loop():
+    """Buferni muntazam bo'shatish"""
+    while True:
+        await asyncio.sleep(INGEST_FLUSH_INTERVAL)
+        await flush_ingest_buffer()
+
+
+class AsyncRateLimiter:
+    """Barcha workerlar uchun umumiy yuborish tezligi (so'rov/soniya)"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_at = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self.next_at)
+        self.next_at = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+publish_limiter = AsyncRateLimiter(PUBLISH_RATE)
+
+PUBLISH_TIME_RE = re.compile(r'^(?:\+(\d+)([mh])|(\d{1,2}):(\d{2}))$')
+
+
+def parse_publish_delay(arg):
+    """'+30m', '+2h' yoki 'HH:MM' (PUBLISH_UTC_OFFSET bo'yicha) -> soniya; mos kelmasa None"""
+    match = PUBLISH_TIME_RE.match(arg)
+    if not match:
+        return None
+    amount, unit, hour, minute = match.groups()
+    if amount:
+        return int(amount) * (60 if unit == 'm' else 3600)
+    hour, minute = int(hour), int(minute)
+    if hour > 23 or minute > 59:
+        return None
+    now = datetime.utcnow() + timedelta(hours=PUBLISH_UTC_OFFSET)
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def publish_to_channel(bot, chat_id, photo, caption, reply_markup):
+    """Bitta kanalga yuborish; vaqtinchalik xatolarda qayta urinish. Xato matni yoki None"""
+    error = None
+    for attempt in range(1, PUBLISH_MAX_ATTEMPTS + 1):
+        await publish_limiter.wait()
+        try:
+            await bot.send_photo(chat_id=chat_id, photo=photo, caption=caption, reply_markup=reply_markup, parse_mode='HTML')
+            inc_metric("publish_sent")
+            return None
+        except RetryAfter as e:
+            error, delay = e, retry_after_seconds(e)
+        except BadRequest as e:
+            # BadRequest NetworkError'dan meros oladi, lekin qayta urinish foyda bermaydi
+            error = e
+            break
+        except (TimedOut, NetworkError) as e:
+            error, delay = e, 2 ** attempt
+        except TelegramError as e:
+            error = e
+            break
+        if attempt < PUBLISH_MAX_ATTEMPTS:
+            inc_metric("publish_retried")
+            await asyncio.sleep(delay)
+    inc_metric("publish_failed")
+    logger.warning("Publish to %s failed: %s", chat_id, error)
+    return str(error)
+
+
+async def publish_post(bot, targets, photo, caption, reply_markup):
+    """Postni kanallarga cheklangan workerlar bilan parallel yuborish: [(kanal, xato yoki None)]"""
+    pending = asyncio.Queue()
+    for target in targets:
+        pending.put_nowait(target)
+    report = {}
+
+    async def worker():
+        while not pending.empty():
+            target = pending.get_nowait()
+            try:
+                report[target] = await publish_to_channel(bot, target, photo, caption, reply_markup)
+            except Exception as e:
+                # Bitta kanal xatosi qolgan kanallar hisobotini yo'qotmasin
+                inc_metric("publish_failed")
+                logger.error("Publish to %s error: %s", target, e)
+                report[target] = str(e) or type(e).__name__
+
+    await asyncio.gather(*(worker() for _ in range(min(PUBLISH_CONCURRENCY, len(targets)))))
+    return [(target, report[target]) for target in targets]
+
+
+def build_link_post(link_data):
+    """AdminLink uchun caption va inline tugma"""
+    keyboard = [[InlineKeyboardButton(f"📥 Yuklab olish", url=link_data['channel_link'])]]
+    return f"📸 <b>{link_data['name']}</b>", InlineKeyboardMarkup(keyboard)
+
+
+def format_publish_report(name, report, elapsed):
+    """Kanallar bo'yicha yetkazish hisoboti"""
+    sent = sum(1 for _, error in report if error is None)
+    lines = [
+        f"✅ <code>{html.escape(str(target))}</code>" if error is None
+        else f"❌ <code>{html.escape(str(target))}</code> — {html.escape(error[:100])}"
+        for target, error in report
+    ]
+    text = (
+        f"📨 <b>{html.escape(name)}</b>\n\n"
+        f"✅ Yuborildi: <b>{sent}</b> / {len(report)}\n"
+        f"⏱ Vaqt: <b>{elapsed:.1f}</b> s\n\n" + '\n'.join(lines)
+    )
+    return text[:4000]
+
+
+async def run_publish(bot, report_chat_id, link_data, targets):
+    """Postni yuborib, hisobotni adminga jo'natish"""
+    caption, reply_markup = build_link_post(link_data)
+    started = time.monotonic()
+    report = await publish_post(bot, targets, link_data['file_id'], caption, reply_markup)
+    await bot.send_message(
+        chat_id=report_chat_id,
+        text=format_publish_report(link_data['name'], report, time.monotonic() - started),
+        parse_mode='HTML'
+    )
+
+
+async def publish_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job queue: rejalashtirilgan postni yuborish"""
+    data = context.job.data
+    link_data = await asyncio.to_thread(get_admin_link, data['link_id'])
+    if not link_data:
+        await context.bot.send_message(chat_id=context.job.chat_id, text=f"❌ Link topilmadi: {data['link_id']}")
+        return
+    await run_publish(context.bot, context.job.chat_id, link_data, data['targets'])
+
+
 async def createlink(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin uchun rasm link yaratish"""
     user_id = str(update.effective_user.id)
@@ -543,45 +2395,72 @@ async def postlink(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text(
             "⚠️ <b>Foydalanish:</b>\n"
-            "<code>/link &lt;link_id&gt;</code>\n\n"
-            "<i>Misol: /link abc12345</i>",
+            "<code>/link &lt;link_id&gt; [kanallar] [+30m | HH:MM]</code>\n\n"
+            "Kanallar ko'rsatilmasa PUBLISH_CHANNELS ro'yxatiga, u ham bo'sh bo'lsa shu chatga yuboriladi.\n\n"
+            "<i>Misol: /link abc12345</i>\n"
+            "<i>Misol: /link abc12345 @kanal1 -1001234567890 21:00</i>",
             parse_mode='HTML'
         )
         return
 
     link_id = context.args[0]
-    link_data = get_admin_link(link_id)
+    link_data = await asyncio.to_thread(get_admin_link, link_id)
 
     if not link_data:
         await update.message.reply_text("❌ Link topilmadi!", parse_mode='HTML')
         return
 
-    file_id = link_data['file_id']
-    channel_link = link_data['channel_link']
-    name = link_data['name']
-
-    keyboard = [[InlineKeyboardButton(f"📥 Yuklab olish", url=channel_link)]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    delay = None
+    targets = []
+    for arg in context.args[1:]:
+        arg_delay = parse_publish_delay(arg)
+        if arg_delay is not None:
+            delay = arg_delay
+        else:
+            targets.append(arg)
+    targets = list(dict.fromkeys(targets or PUBLISH_CHANNELS or [update.effective_chat.id]))
 
-    caption = f"📸 <b>{name}</b>"
+    if delay is not None:
+        if not context.job_queue:
+            await update.message.reply_text("❌ JobQueue o'rnatilmagan, rejalashtirib bo'lmaydi.", parse_mode='HTML')
+            return
+        context.job_queue.run_once(
+            publish_job,
+            when=delay,
+            data={'link_id': link_id, 'targets': targets},
+            chat_id=update.effective_chat.id,
+            name=f"publish_{link_id}"
+        )
+        publish_at = datetime.utcnow() + timedelta(hours=PUBLISH_UTC_OFFSET, seconds=delay)
+        await update.message.reply_text(
+            f"⏰ <b>Rejalashtirildi!</b>\n\n"
+            f"📨 {len(targets)} ta kanal\n"
+            f"🕐 {publish_at.strftime('%d.%m %H:%M')}",
+            parse_mode='HTML'
+        )
+        return
 
-    try:
-        await context.bot.send_photo(chat_id=update.effective_chat.id, photo=file_id, caption=caption, reply_markup=reply_markup, parse_mode='HTML')
-        await update.message.reply_text("✅ Post qilindi!", parse_mode='HTML')
-    except Exception as e:
-        logger.error(f"Post yuborishda xato: {e}")
-        await update.message.reply_text("❌ Xatolik! Rasimni yuborishda muammo.", parse_mode='HTML')
+    await update.message.reply_text(f"📤 <b>{len(targets)}</b> ta kanalga yuborilmoqda...", parse_mode='HTML')
+    # Fonda: webhook 30 soniya kutmaydi, hisobot tugagach yuboriladi
+    context.application.create_task(run_publish(context.bot, update.effective_chat.id, link_data, targets))
 
 
 async def search_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Matnli qidirish"""
     user_id = update.effective_user.id
+    if is_throttled(user_id, "message"):
+        if throttle.should_notify(user_id, THROTTLE_NOTICE_INTERVAL):
+            await update.message.reply_text("⏳ Juda tez! Biroz kuting.")
+        return
+
     user_name = update.effective_user.first_name
     username = update.effective_user.username
     track_user(user_id, user_name, username)
 
+    state = conversation_state.get(user_id)
+
     # Rasim link uchun kanal linkini qabul qilish
-    if context.user_data.get('waiting_for_photo_link'):
+    if state.get('waiting_for_photo_link'):
         if str(user_id) != ADMIN_ID:
             return
         
@@ -591,8 +2470,8 @@ async def search_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ <b>Noto'g'ri link!</b>\n\nHTTP yoki HTTPS link yubor.", parse_mode='HTML')
             return
 
-        photo_name = context.user_data.get('photo_name')
-        photo_file_id = context.user_data.get('photo_file_id')
+        photo_name = state.get('photo_name')
+        photo_file_id = state.get('photo_file_id')
 
         if not photo_name or not photo_file_id:
             await update.message.reply_text("❌ Xoto! Rasmni qayta forward qiling.", parse_mode='HTML')
@@ -600,9 +2479,7 @@ async def search_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         link_id = save_admin_link(photo_name, photo_file_id, channel_link)
         
-        context.user_data['waiting_for_photo_link'] = False
-        context.user_data.pop('photo_name', None)
-        context.user_data.pop('photo_file_id', None)
+        conversation_state.pop(user_id, 'waiting_for_photo_link', 'photo_name', 'photo_file_id')
 
         success_text = (
             f"✅ <b>LINK SAQLANDI!</b>\n\n"
@@ -616,7 +2493,7 @@ async def search_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(success_text, parse_mode='HTML')
         return
 
-    if context.user_data.get('waiting_for_createlink'):
+    if state.get('waiting_for_createlink'):
         if not update.message.photo and not update.message.video and not update.message.audio:
             await update.message.reply_text("📸 Rasm, video yoki audio jo'nating!", parse_mode='HTML')
             return
@@ -628,7 +2505,7 @@ async def search_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
                    update.message.audio.file_id)
 
         link_id = save_admin_link(caption, file_id, file_type)
-        context.user_data['waiting_for_createlink'] = False
+        conversation_state.pop(user_id, 'waiting_for_createlink')
 
         await update.message.reply_text(f"✅ Link yaratildi!\n\n🔗 ID: <code>{link_id}</code>", parse_mode='HTML')
         return
@@ -639,47 +2516,100 @@ async def search_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Kamida <b>2 ta</b> harf kiriting.", parse_mode='HTML')
         return
 
-    results = search_movies_db(query)
+    if str(user_id) != ADMIN_ID:
+        # Oxirgi so'rov bajariladi: oyna ichida kelgan tuzatish oldingisini bekor qiladi
+        chat_id = update.effective_chat.id
+        seq, delay = throttle.debounce(chat_id, SEARCH_DEBOUNCE)
+        if delay:
+            await asyncio.sleep(delay)
+            if not throttle.is_latest(chat_id, seq):
+                inc_metric("search_debounced")
+                return
+
+    results = await asyncio.to_thread(search_movies_db, query)
+    record_activity('searches')
 
     if not results:
+        suggestions = await asyncio.to_thread(suggest_movies, query)
+        if suggestions:
+            keyboard = []
+            for movie_id, name, file_type in suggestions:
+                emoji = get_file_emoji(file_type)
+                keyboard.append([InlineKeyboardButton(f"{emoji} {name[:45]}", callback_data=f"get_{movie_id}")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await update.message.reply_text(f"🤔 <b>Aniq moslik topilmadi</b>\n\n🔍 So'rov: <code>{query}</code>\n\n💡 Balki shulardan birini nazarda tutgandirsiz:", reply_markup=reply_markup, parse_mode='HTML')
+            return
+
         await update.message.reply_text(f"😔 <b>Hech narsa topilmadi</b>\n\n🔍 So'rov: <code>{query}</code>\n\n💡 Boshqa nom bilan qidirib ko'ring", parse_mode='HTML')
         return
 
-    total = len(results)
-    page = 0
-    start_idx = page * MOVIES_PER_PAGE
-    end_idx = start_idx + MOVIES_PER_PAGE
-    page_results = results[start_idx:end_idx]
+    token = search_results.put(results)
+    stored = min(len(results), SEARCH_TOKEN_MAX_ROWS)
+    result_text, reply_markup = build_search_page(token, len(results), stored, 0, results[:MOVIES_PER_PAGE])
 
-    keyboard = []
-    for movie_id, movie_data in page_results:
-        emoji = get_file_emoji(movie_data.get('file_type', 'video'))
-        keyboard.append([InlineKeyboardButton(f"{emoji} {movie_data['name'][:45]}", callback_data=f"get_{movie_id}")])
+    await update.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
+    return
 
-    if end_idx < total:
-        keyboard.append([InlineKeyboardButton(f"Keyingi ({total - end_idx}) ▶️", callback_data=f"page_{page + 1}_{query}")])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    result_text = f"🔍 <b>QIDIRUV NATIJALARI</b>\n\n━━━━━━━━━━━━━━━━━━━━\n📊 Topildi: <b>{total}</b> ta\n📄 Sahifa: <b>{page + 1}</b> / <b>{(total - 1) // MOVIES_PER_PAGE + 1}</b>\n━━━━━━━━━━━━━━━━━━━━\n\n👇 Kinoni tanlang:"
+def get_movies_by_ids(movie_ids):
+    """Berilgan tartibda (movie_id, name, file_type); o'chirilganlar tushib qoladi"""
+    snapshot = catalog_cache.snapshot
+    if snapshot:
+        rows = []
+        for movie_id in movie_ids:
+            i = snapshot.positions.get(movie_id)
+            if i is not None:
+                rows.append((movie_id, snapshot.names[i], snapshot.file_types[i]))
+        return rows
+    found = run_read(lambda session: {
+        row[0]: tuple(row) for row in session.execute(
+            db.select(Movie.movie_id, Movie.name, Movie.file_type).where(Movie.movie_id.in_(movie_ids))
+        )
+    })
+    return [found[movie_id] for movie_id in movie_ids if movie_id in found]
 
-    await update.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
-    return
+
+def build_search_page(token, total, stored, offset, page_rows):
+    """Qidiruv sahifasi: (matn, klaviatura); tugmalarda faqat token va offset"""
+    end_idx = offset + MOVIES_PER_PAGE
+    keyboard = []
+    for movie_id, name, file_type in page_rows:
+        emoji = get_file_emoji(file_type)
+        keyboard.append([InlineKeyboardButton(f"{emoji} {name[:45]}", callback_data=f"get_{movie_id}")])
+
+    nav_buttons = []
+    if offset > 0:
+        nav_buttons.append(InlineKeyboardButton("◀️ Oldingi", callback_data=f"sp_{token}_{max(offset - MOVIES_PER_PAGE, 0)}"))
+    if end_idx < stored:
+        label = f"Keyingi ({stored - end_idx}) ▶️" if offset == 0 else "Keyingi ▶️"
+        nav_buttons.append(InlineKeyboardButton(label, callback_data=f"sp_{token}_{end_idx}"))
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+
+    page = offset // MOVIES_PER_PAGE
+    shown = f"📌 Ko'rsatiladi: birinchi <b>{stored}</b> ta\n" if stored < total else ""
+    result_text = f"🔍 <b>QIDIRUV NATIJALARI</b>\n\n━━━━━━━━━━━━━━━━━━━━\n📊 Topildi: <b>{total}</b> ta\n{shown}📄 Sahifa: <b>{page + 1}</b> / <b>{(stored - 1) // MOVIES_PER_PAGE + 1}</b>\n━━━━━━━━━━━━━━━━━━━━\n\n👇 Kinoni tanlang:"
+    return result_text, InlineKeyboardMarkup(keyboard)
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Tugma click qabuli"""
     user_id = update.effective_user.id
+    query = update.callback_query
+    if is_throttled(user_id, "callback"):
+        await query.answer("⏳ Juda tez! Biroz kuting.")
+        return
+
     user_name = update.effective_user.first_name
     username = update.effective_user.username
     track_user(user_id, user_name, username)
 
-    query = update.callback_query
     await query.answer()
     data = query.data
 
     if data.startswith("get_"):
         movie_id = data[4:]
-        movie = get_movie_by_id(movie_id)
+        movie = await asyncio.to_thread(get_movie_by_id, movie_id)
 
         if not movie:
             await query.edit_message_text("❌ <b>Kino topilmadi</b>\n\nEhtimol o'chirilgan.", parse_mode='HTML')
@@ -691,49 +2621,47 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         caption = f"{emoji} <b>{movie['name']}</b>"
 
         try:
-            if file_type == "video":
-                await context.bot.send_video(chat_id=query.message.chat_id, video=file_id, caption=caption, parse_mode='HTML')
-            elif file_type == "document":
-                await context.bot.send_document(chat_id=query.message.chat_id, document=file_id, caption=caption, parse_mode='HTML')
-            elif file_type == "audio":
-                await context.bot.send_audio(chat_id=query.message.chat_id, audio=file_id, caption=caption, parse_mode='HTML')
-            elif file_type == "photo":
-                await context.bot.send_photo(chat_id=query.message.chat_id, photo=file_id, caption=caption, parse_mode='HTML')
+            await send_movie_file(context.bot, query.message.chat_id, file_type, file_id, caption)
+            popularity.record(movie_id)
+            record_activity('downloads')
         except Exception as e:
-            logger.error(f"Faylni yuborishda xato: {e}")
+            logger.error("Faylni yuborishda xato: %s", e)
+            dead_letters.add("send", {
+                'chat_id': query.message.chat_id,
+                'file_type': file_type,
+                'file_id': file_id,
+                'caption': caption,
+            }, e)
             await query.message.reply_text("❌ <b>Xatolik!</b>\n\nFaylni yuborishda muammo.", parse_mode='HTML')
 
     elif data.startswith("admin_"):
         admin_action = data.split("_")[1]
         await query.message.reply_text(f"📤 {admin_action.upper()} jo'nang va caption sifatida nomi kiriting!")
-        context.user_data['admin_action'] = admin_action
+        conversation_state.update(user_id, admin_action=admin_action)
+
+    elif data.startswith("sp_"):
+        token, offset = data[3:].rsplit("_", 1)
+        offset = int(offset)
+        stored_results = search_results.get(token)
+        if stored_results is None:
+            inc_metric("search_token_expired")
+            await query.message.reply_text("⌛ Qidiruv natijalari eskirdi. Iltimos, qaytadan qidiring.", parse_mode='HTML')
+            return
+        total, movie_ids = stored_results
+        page_rows = await asyncio.to_thread(get_movies_by_ids, movie_ids[offset:offset + MOVIES_PER_PAGE])
+        result_text, reply_markup = build_search_page(token, total, len(movie_ids), offset, page_rows)
+        await query.edit_message_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
 
     elif data.startswith("page_"):
-        parts = data.split("_", 2)
-        page = int(parts[1])
-        search_query = parts[2]
-        results = search_movies_db(search_query)
-        total = len(results)
-        start_idx = page * MOVIES_PER_PAGE
-        end_idx = start_idx + MOVIES_PER_PAGE
-        page_results = results[start_idx:end_idx]
-
-        keyboard = []
-        for movie_id, movie_data in page_results:
-            emoji = get_file_emoji(movie_data.get('file_type', 'video'))
-            keyboard.append([InlineKeyboardButton(f"{emoji} {movie_data['name'][:45]}", callback_data=f"get_{movie_id}")])
-
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(InlineKeyboardButton("◀️ Oldingi", callback_data=f"page_{page - 1}_{search_query}"))
-        if end_idx < total:
-            nav_buttons.append(InlineKeyboardButton(f"Keyingi ▶️", callback_data=f"page_{page + 1}_{search_query}"))
-
-        if nav_buttons:
-            keyboard.append(nav_buttons)
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        result_text = f"🔍 <b>QIDIRUV NATIJALARI</b>\n\n━━━━━━━━━━━━━━━━━━━━\n📊 Topildi: <b>{total}</b> ta\n📄 Sahifa: <b>{page + 1}</b> / <b>{(total - 1) // MOVIES_PER_PAGE + 1}</b>\n━━━━━━━━━━━━━━━━━━━━\n\n👇 Kinoni tanlang:"
+        # Eski formatdagi tugmalar (oldingi xabarlarda qolgan)
+        _, page, search_query = data.split("_", 2)
+        results = await asyncio.to_thread(search_movies_db, search_query)
+        token = search_results.put(results)
+        stored = min(len(results), SEARCH_TOKEN_MAX_ROWS)
+        offset = min(int(page) * MOVIES_PER_PAGE, max(stored - 1, 0)) // MOVIES_PER_PAGE * MOVIES_PER_PAGE
+        result_text, reply_markup = build_search_page(
+            token, len(results), stored, offset, results[offset:offset + MOVIES_PER_PAGE]
+        )
         await query.edit_message_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
 
     elif data.startswith("list_"):
@@ -745,9 +2673,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         page_results = movies[start_idx:end_idx]
 
         keyboard = []
-        for movie_id, movie_data in page_results:
-            emoji = get_file_emoji(movie_data.get('file_type', 'video'))
-            keyboard.append([InlineKeyboardButton(f"{emoji} {movie_data['name'][:45]}", callback_data=f"get_{movie_id}")])
+        for movie_id, name, file_type in page_results:
+            emoji = get_file_emoji(file_type)
+            keyboard.append([InlineKeyboardButton(f"{emoji} {name[:45]}", callback_data=f"get_{movie_id}")])
 
         nav_buttons = []
         if page > 0:
@@ -776,9 +2704,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         page_results = movies[start_idx:end_idx]
 
         keyboard = []
-        for movie_id, movie_data in page_results:
-            emoji = get_file_emoji(movie_data.get('file_type', 'video'))
-            keyboard.append([InlineKeyboardButton(f"{emoji} {movie_data['name'][:45]}", callback_data=f"get_{movie_id}")])
+        for movie_id, name, file_type in page_results:
+            emoji = get_file_emoji(file_type)
+            keyboard.append([InlineKeyboardButton(f"{emoji} {name[:45]}", callback_data=f"get_{movie_id}")])
 
         if end_idx < total:
             keyboard.append([InlineKeyboardButton(f"Keyingi ({total - end_idx}) ▶️", callback_data=f"list_{page + 1}")])
@@ -790,6 +2718,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await query.edit_message_text(result_text, reply_markup=reply_markup, parse_mode='HTML')
 
+    elif data == "cmd_top":
+        top_text, reply_markup = await asyncio.to_thread(build_top_message)
+
+        if not top_text:
+            await query.edit_message_text("📭 <b>Hozircha top ro'yxat bo'sh</b>\n\nKinolarni yuklab oling, ro'yxat shakllanadi.", parse_mode='HTML')
+            return
+
+        await query.edit_message_text(top_text, reply_markup=reply_markup, parse_mode='HTML')
+
     elif data == "cmd_random":
         movie_id, movie = get_random_movie()
 
@@ -804,16 +2741,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         caption = f"🎲 <b>TASODIFIY KINO</b>\n\n{emoji} <b>{movie_name}</b>\n\n💎 <i>Yana birini olish: /random</i>"
 
         try:
-            if file_type == "video":
-                await context.bot.send_video(chat_id=query.message.chat_id, video=file_id, caption=caption, parse_mode='HTML')
-            elif file_type == "document":
-                await context.bot.send_document(chat_id=query.message.chat_id, document=file_id, caption=caption, parse_mode='HTML')
-            elif file_type == "audio":
-                await context.bot.send_audio(chat_id=query.message.chat_id, audio=file_id, caption=caption, parse_mode='HTML')
-            elif file_type == "photo":
-                await context.bot.send_photo(chat_id=query.message.chat_id, photo=file_id, caption=caption, parse_mode='HTML')
+            await send_movie_file(context.bot, query.message.chat_id, file_type, file_id, caption)
+            popularity.record(movie_id)
+            record_activity('downloads')
         except Exception as e:
-            logger.error(f"Faylni yuborishda xato: {e}")
+            logger.error("Faylni yuborishda xato: %s", e)
+            dead_letters.add("send", {
+                'chat_id': query.message.chat_id,
+                'file_type': file_type,
+                'file_id': file_id,
+                'caption': caption,
+            }, e)
             await query.message.reply_text("❌ <b>Xatolik!</b>\n\nFaylni yuborishda muammo.", parse_mode='HTML')
 
     elif data == "cmd_about":
@@ -856,7 +2794,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "├ 📋 /list - Kinolar ro'yxati\n"
                 "├ 🗑 /delete ID - O'chirish\n"
                 "├ 🔗 /createlink - Link yaratish\n"
-                "└ 📨 /link - Link post qilish\n\n"
+                "├ 📨 /link - Link post qilish\n"
+                "├ 🧹 /compact - Dublikatlarni tozalash\n"
+                "├ 🔁 /replay N - Xatolarni qayta yuborish\n"
+                "├ 🧹 /maintenance - Arxivlash va tozalash\n"
+                "└ ⏱ /profile [soniya] [cpu|memory] - Profil\n\n"
                 "📥 <b>KINO QO'SHISH:</b>\n"
                 "Kanaldan video/fayl/rasm forward qiling"
             )
@@ -873,6 +2815,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "├ /start - Bosh sahifa\n"
                 "├ /list - To'liq ro'yxat\n"
                 "├ /random - Tasodifiy kino\n"
+                "├ /top - Top kinolar\n"
                 "└ /about - Bot haqida\n\n"
                 "🍿 <i>Yaxshi tomosha!</i>"
             )
@@ -912,6 +2855,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 InlineKeyboardButton("📋 Ro'yxat", callback_data="cmd_list"),
                 InlineKeyboardButton("🎲 Tasodifiy", callback_data="cmd_random")
             ],
+            [InlineKeyboardButton("🔥 Top kinolar", callback_data="cmd_top")],
             [
                 InlineKeyboardButton("ℹ️ Bot haqida", callback_data="cmd_about"),
                 InlineKeyboardButton("📖 Yordam", callback_data="cmd_help")
@@ -921,6 +2865,252 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode='HTML')
 
 
+profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """Barcha thread'lar stack'larini davriy yig'ish: {collapsed_stack: namunalar}"""
+    me = threading.get_ident()
+    stacks = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            parts.append(names.get(ident, str(ident)))
+            key = ';'.join(reversed(parts))
+            stacks[key] = stacks.get(key, 0) + 1
+        time.sleep(interval)
+    return stacks
+
+
+def top_functions(stacks, limit):
+    """Eng ko'p vaqt olgan funksiyalar: (funksiya, self, total) ro'yxati"""
+    self_counts = {}
+    total_counts = {}
+    for key, count in stacks.items():
+        frames = key.split(';')[1:]
+        if not frames:
+            continue
+        self_counts[frames[-1]] = self_counts.get(frames[-1], 0) + count
+        for name in set(frames):
+            total_counts[name] = total_counts.get(name, 0) + count
+    ranked = sorted(total_counts, key=lambda name: (self_counts.get(name, 0), total_counts[name]), reverse=True)
+    return [(name, self_counts.get(name, 0), total_counts[name]) for name in ranked[:limit]]
+
+
+def trace_memory(seconds, limit):
+    """tracemalloc: oyna davomida eng ko'p o'sgan joylar"""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(25)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    return [str(stat) for stat in after.compare_to(before, 'lineno')[:limit]]
+
+
+def run_profile(seconds, mode, limit):
+    """Profil olish; boshqa profil ishlayotgan bo'lsa None"""
+    if not profile_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+        if mode == 'memory':
+            return {'mode': mode, 'seconds': seconds, 'top': trace_memory(seconds, limit)}
+        stacks = sample_stacks(seconds)
+        collapsed = '\n'.join(f"{key} {count}" for key, count in sorted(stacks.items())) + '\n'
+        return {
+            'mode': 'cpu',
+            'seconds': seconds,
+            'samples': sum(stacks.values()),
+            'top': [
+                {'function': name, 'self': self_count, 'total': total}
+                for name, self_count, total in top_functions(stacks, limit)
+            ],
+            'collapsed': collapsed,
+        }
+    finally:
+        profile_lock.release()
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Jonli profil olish: /profile [soniya] [cpu|memory] (faqat admin)"""
+    user_id = str(update.effective_user.id)
+    if user_id != ADMIN_ID:
+        return
+
+    args = context.args or []
+    seconds = float(args[0]) if args and args[0].replace('.', '', 1).isdigit() else 10
+    mode = args[1] if len(args) > 1 and args[1] in ('cpu', 'memory') else 'cpu'
+
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    await update.message.reply_text(f"⏱ <b>{mode}</b> profil: {seconds:g} soniya...", parse_mode='HTML')
+    # Webhook javobini kutib qolmaslik uchun profil fonda olinadi
+    context.application.create_task(send_profile(context.bot, update.effective_chat.id, seconds, mode))
+
+
+async def send_profile(bot, chat_id, seconds, mode):
+    """Profilni olib natijani adminga yuborish"""
+    result = await asyncio.to_thread(run_profile, seconds, mode, 15)
+    if result is None:
+        await bot.send_message(chat_id=chat_id, text="⚠️ Boshqa profil ishlamoqda.", parse_mode='HTML')
+        return
+
+    if mode == 'memory':
+        lines = '\n'.join(result['top']) or "O'sish yo'q"
+        await bot.send_message(chat_id=chat_id, text=f"🧠 Xotira o'sishi:\n\n{lines}"[:4000])
+        return
+
+    lines = '\n'.join(f"{item['self']:>5} {item['total']:>5}  {item['function']}" for item in result['top'])
+    await bot.send_message(chat_id=chat_id, text=f"🔥 Top funksiyalar (self / total, {result['samples']} namuna):\n\n{lines}"[:4000])
+    await bot.send_document(
+        chat_id=chat_id,
+        document=InputFile(io.BytesIO(result['collapsed'].encode()), filename='profile.collapsed'),
+        caption="flamegraph.pl / speedscope uchun collapsed stack"
+    )
+
+
+async def error_handler(update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler xatosi: update dead-letter faylga yoziladi"""
+    logger.error("Update handler error: %s", context.error, exc_info=context.error)
+    failures = replay_failures.get()
+    if failures is not None:
+        failures.append(context.error)
+    if isinstance(update, Update):
+        dead_letters.add("update", update.to_dict(), context.error)
+
+
+async def replay_dead_letters(limit):
+    """Dead-letter yozuvlarini REPLAY_RATE tezlikda qayta bajarish.
+
+    Yozuv faqat bajarilgandan yoki qayta navbatga qo'yilgandan keyin
+    hisobdan chiqadi; vazifa bekor qilinsa qolganlari faylga qaytadi.
+    """
+    replayed = 0
+    requeued = 0
+    pending = dead_letters.take(limit)
+    try:
+        while pending:
+            entry = pending[0]
+            attempts = entry['attempts'] + 1
+            delay = 1 / REPLAY_RATE
+            token = replay_attempts.set(attempts)
+            try:
+                if entry['kind'] == 'update':
+                    # Xato bo'lsa error_handler yozuvni attempts bilan qayta qo'shadi
+                    failures = []
+                    failures_token = replay_failures.set(failures)
+                    try:
+                        await process_update_with_context(Update.de_json(entry['payload'], application.bot))
+                    finally:
+                        replay_failures.reset(failures_token)
+                    if failures:
+                        requeued += 1
+                    else:
+                        replayed += 1
+                else:
+                    payload = entry['payload']
+                    await send_movie_file(
+                        application.bot, payload['chat_id'], payload['file_type'],
+                        payload['file_id'], payload['caption']
+                    )
+                    replayed += 1
+            except RetryAfter as e:
+                dead_letters.add(entry['kind'], entry['payload'], e, attempts=entry['attempts'])
+                requeued += 1
+                delay = retry_after_seconds(e)
+            except Exception as e:
+                dead_letters.add(entry['kind'], entry['payload'], e)
+                requeued += 1
+            finally:
+                replay_attempts.reset(token)
+            pending.pop(0)
+            await asyncio.sleep(delay)
+    finally:
+        dead_letters.restore(pending)
+    inc_metric("dead_letter_replayed", replayed)
+    return replayed, requeued
+
+
+replay_lock = asyncio.Lock()
+
+
+async def run_replay(bot, chat_id, limit):
+    """Fonda qayta yuborish va natijani adminga jo'natish"""
+    async with replay_lock:
+        replayed, requeued = await replay_dead_letters(limit)
+    await bot.send_message(
+        chat_id=chat_id,
+        text=f"✅ <b>Tayyor!</b>\n\n🔁 Bajarildi: <b>{replayed}</b>\n⚠️ Qayta navbatda: <b>{requeued}</b>\n📦 Qoldi: <b>{len(dead_letters)}</b>",
+        parse_mode='HTML'
+    )
+
+
+async def replay_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Dead-letter yozuvlarini qayta yuborish (faqat admin)"""
+    user_id = str(update.effective_user.id)
+    if user_id != ADMIN_ID:
+        return
+
+    limit = int(context.args[0]) if context.args and context.args[0].isdigit() else 50
+    pending = len(dead_letters)
+    if pending == 0:
+        await update.message.reply_text("📭 Dead-letter navbati bo'sh.", parse_mode='HTML')
+        return
+    if replay_lock.locked():
+        await update.message.reply_text("⏳ Qayta yuborish allaqachon ishlayapti.", parse_mode='HTML')
+        return
+
+    await update.message.reply_text(f"🔁 <b>{min(limit, pending)}</b> ta yozuv qayta yuborilmoqda...", parse_mode='HTML')
+    context.application.create_task(run_replay(context.bot, update.effective_chat.id, limit))
+
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job queue: muntazam arxivlash va tozalash"""
+    try:
+        await asyncio.to_thread(run_maintenance)
+    except Exception as e:
+        logger.error("Maintenance job error: %s", e)
+
+
+async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Arxivlash va tozalashni hozir ishga tushirish (faqat admin)"""
+    user_id = str(update.effective_user.id)
+    if user_id != ADMIN_ID:
+        return
+
+    await update.message.reply_text("🧹 Texnik xizmat boshlandi...", parse_mode='HTML')
+    # Arxivlash va VACUUM uzoq davom etishi mumkin: webhook kutib qolmasin
+    context.application.create_task(run_maintenance_report(context.bot, update.effective_chat.id))
+
+
+async def run_maintenance_report(bot, chat_id):
+    """Fonda texnik xizmat va natijani adminga yuborish"""
+    archived, pruned = await asyncio.to_thread(run_maintenance)
+    active = await asyncio.to_thread(get_active_user_count)
+    await bot.send_message(
+        chat_id=chat_id,
+        text=(
+            f"✅ <b>Tayyor!</b>\n\n"
+            f"📦 Arxivlangan foydalanuvchilar: <b>{archived}</b>\n"
+            f"🗑 O'chirilgan linklar: <b>{pruned}</b>\n"
+            f"👤 Faol jadvalda: <b>{active}</b> ta"
+        ),
+        parse_mode='HTML'
+    )
+
+
 def create_application():
     """Bot application yaratish"""
     global application
@@ -930,18 +3120,43 @@ def create_application():
 
     application = Application.builder().token(BOT_TOKEN).build()
 
+    if SOURCE_CHANNELS:
+        chat_ids = [int(c) for c in SOURCE_CHANNELS if c.lstrip('-').isdigit()]
+        usernames = [c.lstrip('@') for c in SOURCE_CHANNELS if not c.lstrip('-').isdigit()]
+        source_filter = filters.Chat(chat_id=chat_ids) | filters.Chat(username=usernames)
+        application.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POSTS & source_filter, channel_post))
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CommandHandler("list", list_movies))
     application.add_handler(CommandHandler("about", about_command))
     application.add_handler(CommandHandler("random", random_command))
+    application.add_handler(CommandHandler("top", top_command))
     application.add_handler(CommandHandler("delete", delete_movie))
     application.add_handler(CommandHandler("createlink", createlink))
     application.add_handler(CommandHandler("link", postlink))
+    application.add_handler(CommandHandler("compact", compact_command))
+    application.add_handler(CommandHandler("replay", replay_command))
+    application.add_handler(CommandHandler("maintenance", maintenance_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.FORWARDED, handle_forward))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_movies))
+    # Faqat oddiy xabarlar: manba bo'lmagan kanallar postlari foydalanuvchi handler'lariga tushmaydi
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.FORWARDED, handle_forward))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, search_movies))
+    application.add_error_handler(error_handler)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = with_handler_name(handler.callback)
+
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            maintenance_job,
+            interval=MAINTENANCE_INTERVAL_HOURS * 3600,
+            first=600,
+            name="maintenance"
+        )
+    else:
+        logger.warning("JobQueue unavailable: install python-telegram-bot[job-queue]")
 
     return application
 
@@ -975,38 +3190,104 @@ async def run_bot_loop():
     global application, loop
     loop = asyncio.get_event_loop()
 
-    application = create_application()
+    with startup_phase("create_application"):
+        application = create_application()
     if application is None:
         logger.error("Failed to create application")
         return
 
-    await application.initialize()
-    await application.start()
+    with startup_phase("initialize"):
+        await application.initialize()
+    with startup_phase("start"):
+        await application.start()
+
+    if SOURCE_CHANNELS:
+        start_background_task(ingest_flush_loop())
+    start_background_task(popularity_flush_loop())
+    start_background_task(rollup_flush_loop())
 
     webhook_url = get_webhook_url()
+    with startup_phase("webhook"):
+        await ensure_webhook(webhook_url)
+
+    bot_ready.set()
+    startup_timings["ready"] = time.perf_counter() - STARTED_AT
+    logger.info("Bot is ready to receive updates (%.2f s after start)", startup_timings['ready'])
+
+    while True:
+        await asyncio.sleep(3600)
+
+
+async def ensure_webhook(webhook_url):
+    """Webhook'ni o'rnatish (allaqachon to'g'ri bo'lsa o'tkazib yuboriladi)"""
     if webhook_url:
+        try:
+            info = await application.bot.get_webhook_info()
+            if info.url == webhook_url:
+                logger.info("Webhook already set to: %s", webhook_url)
+                return
+        except Exception as e:
+            logger.warning("getWebhookInfo error: %s", e)
+
         max_retries = 5
         for attempt in range(max_retries):
             try:
                 await application.bot.set_webhook(webhook_url)
-                logger.info(f"Webhook set to: {webhook_url}")
+                logger.info("Webhook set to: %s", webhook_url)
                 break
             except Exception as e:
                 if "Retry" in str(e) or "429" in str(e):
                     wait_time = 2**attempt
-                    logger.warning(f"Rate limited. Waiting {wait_time} seconds...")
+                    logger.warning("Rate limited. Waiting %s seconds...", wait_time)
                     await asyncio.sleep(wait_time)
                 else:
-                    logger.error(f"Webhook error: {e}")
+                    logger.error("Webhook error: %s", e)
                     break
     else:
         logger.error("No webhook URL found. Set WEBHOOK_URL environment variable.")
 
-    bot_ready.set()
-    logger.info("Bot is ready to receive updates")
 
-    while True:
-        await asyncio.sleep(3600)
+def start_background_task(coro):
+    """Fon vazifasi; havola saqlanadi, aks holda GC uni o'chirib yuborishi mumkin"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def stop_background_tasks():
+    """Flush sikllarini to'xtatish (ular yakuniy flush bilan bir vaqtda yozmasin)"""
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
+@atexit.register
+def flush_on_exit():
+    """Jarayon tugayotganda buferlarni sinxron yozish.
+
+    atexit paytida thread-pool executor yopilgan bo'ladi, shuning uchun
+    asyncio.to_thread ishlamaydi: yozuvlar shu thread'da bajariladi.
+    """
+    if loop is not None and loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(stop_background_tasks(), loop).result(timeout=5)
+        except Exception as e:
+            logger.warning("Background task stop error: %s", e)
+
+    rows = list(ingest_buffer.values())
+    ingest_buffer.clear()
+    for name, write, pending in (
+        ("ingest", save_movies_batch, rows),
+        ("popularity", flush_popularity, popularity.drain()),
+        ("rollup", flush_rollups, activity.drain()),
+    ):
+        if not pending:
+            continue
+        try:
+            write(pending)
+        except Exception as e:
+            logger.error("Shutdown flush error (%s): %s", name, e)
 
 
 def start_bot_thread():
@@ -1021,11 +3302,34 @@ def start_bot_thread():
     thread.start()
 
 
+async def process_update_with_context(update):
+    """Update'ni qayta ishlash; loglar update_id/user_id bilan belgilanadi"""
+    user = update.effective_user
+    token = log_context.set({'update_id': update.update_id, 'user_id': user.id if user else None})
+    try:
+        await application.process_update(update)
+    finally:
+        log_context.reset(token)
+
+
+def with_handler_name(callback):
+    """Handler nomini log kontekstiga qo'shish (error_handler loglari ham shu nomni oladi)"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        log_context.set({**(log_context.get() or {}), 'handler': callback.__name__})
+        return await callback(update, context)
+    return wrapper
+
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Webhook endpoint"""
     global application, loop
 
+    # Flask bot tayyor bo'lishini kutmasdan ishga tushadi; birinchi update shu yerda kutadi
+    if BOT_TOKEN and not bot_ready.is_set():
+        bot_ready.wait(timeout=BOT_READY_TIMEOUT)
+
     if application is None or loop is None:
         logger.error("Application not initialized")
         return 'Bot not ready', 500
@@ -1034,14 +3338,24 @@ def webhook():
         logger.error("Application not running")
         return 'Bot not running', 500
 
+    payload = request.get_json()
+    future = None
     try:
-        update = Update.de_json(request.get_json(), application.bot)
-        future = asyncio.run_coroutine_threadsafe(application.process_update(update), loop)
+        update = Update.de_json(payload, application.bot)
+        future = asyncio.run_coroutine_threadsafe(process_update_with_context(update), loop)
         future.result(timeout=30)
         return 'ok'
     except Exception as e:
-        logger.error(f"Webhook error: {e}")
-        return 'error', 500
+        logger.error("Webhook error: %s", e)
+        if future is not None:
+            future.cancel()
+        try:
+            dead_letters.add("update", payload, e)
+        except OSError as store_error:
+            logger.error("Dead letter write error: %s", store_error)
+            return 'error', 500
+        # Update saqlandi: Telegram qayta yubormasin, /replay bilan bajariladi
+        return 'ok'
 
 
 @app.route('/')
@@ -1056,13 +3370,55 @@ def health():
     return 'OK'
 
 
+@app.route('/debug/profile')
+def profile_endpoint():
+    """Jonli profil (token X-Admin-Token header'da): ?seconds=10&mode=cpu|memory&top=20&format=json|collapsed"""
+    # Token faqat header'da: query string access/proxy loglariga tushadi
+    token = request.headers.get('X-Admin-Token', '')
+    if not PROFILER_TOKEN or not hmac.compare_digest(token, PROFILER_TOKEN):
+        return 'Forbidden', 403
+
+    seconds = min(request.args.get('seconds', 10, type=float), PROFILE_HTTP_MAX_SECONDS)
+    mode = request.args.get('mode', 'cpu')
+    limit = request.args.get('top', 20, type=int)
+    result = run_profile(seconds, mode, limit)
+    if result is None:
+        return 'Profile already running', 409
+
+    if mode != 'memory' and request.args.get('format') == 'collapsed':
+        return result['collapsed'], 200, {
+            'Content-Type': 'text/plain',
+            'Content-Disposition': 'attachment; filename=profile.collapsed'
+        }
+    return jsonify(result)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Hisoblagichlar (Prometheus text formatida)"""
+    with metrics_lock:
+        snapshot = dict(metrics)
+    for phase, seconds in startup_timings.items():
+        snapshot[f"startup_{phase}_seconds"] = round(seconds, 4)
+    for name, func in gauges.items():
+        try:
+            snapshot[name] = func()
+        except Exception as e:
+            logger.warning("Gauge %s error: %s", name, e)
+    lines = [f"kinobot_{name} {value}" for name, value in sorted(snapshot.items())]
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+if catalog_cache.enabled:
+    catalog_cache.start()
+elif BOT_TOKEN:
+    fuzzy_index.refresh_async(load_fuzzy_rows)
+
 if BOT_TOKEN:
     start_bot_thread()
 
 if __name__ == '__main__':
-    if BOT_TOKEN:
-        bot_ready.wait(timeout=15)
-    else:
+    if not BOT_TOKEN:
         logger.warning("BOT_TOKEN not set. Webhook not configured.")
 
     app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
@@ -16,7 +16,9 @@ class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     movie_id = db.Column(db.String(255), unique=True, nullable=False)
     name = db.Column(db.String(500), nullable=False)
+    search_key = db.Column(db.String(500), index=True)
     file_id = db.Column(db.String(255), nullable=False)
+    file_unique_id = db.Column(db.String(255), unique=True, index=True)
     file_type = db.Column(db.String(50), nullable=False)
     channel_id = db.Column(db.String(100))
     message_id = db.Column(db.String(100))
@@ -32,6 +34,17 @@ class Movie(db.Model):
         }
 
 
+class MovieStat(db.Model):
+    __tablename__ = 'movie_stats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    movie_id = db.Column(db.String(255), unique=True, nullable=False)
+    request_count = db.Column(db.Integer, default=0, nullable=False)
+    # log ko'rinishidagi vaqt bilan so'nadigan ball: ln(sum(n * 2^(t / half_life)))
+    trend_score = db.Column(db.Float, default=0.0, nullable=False, index=True)
+    last_requested = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -40,7 +53,19 @@ class User(db.Model):
     first_name = db.Column(db.String(255))
     username = db.Column(db.String(255))
     interaction_count = db.Column(db.Integer, default=0)
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class ArchivedUser(db.Model):
+    __tablename__ = 'users_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(100), unique=True, nullable=False)
+    first_name = db.Column(db.String(255))
+    username = db.Column(db.String(255))
+    interaction_count = db.Column(db.Integer, default=0)
+    last_seen = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class AdminLink(db.Model):
@@ -51,7 +76,7 @@ class AdminLink(db.Model):
     name = db.Column(db.String(500), nullable=False)
     file_id = db.Column(db.String(255), nullable=False)
     channel_link = db.Column(db.String(500), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def to_dict(self):
         return {
@@ -59,3 +84,27 @@ class AdminLink(db.Model):
             'file_id': self.file_id,
             'channel_link': self.channel_link
         }
+
+
+class DailyStat(db.Model):
+    __tablename__ = 'daily_stats'
+    __table_args__ = (db.UniqueConstraint('day', 'metric', name='uq_daily_stats_day_metric'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    metric = db.Column(db.String(50), nullable=False)
+    value = db.Column(db.Integer, default=0, nullable=False)
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.String(64), nullable=False)
+
+
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
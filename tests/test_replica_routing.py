@@ -0,0 +1,61 @@
+"""run_read replica marshrutini ikkita vaqtinchalik SQLite fayl bilan tekshirish."""
+import os
+import sys
+import tempfile
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'primary.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = f"sqlite:///{os.path.join(_tmpdir, 'replica.db')}"
+os.environ.pop("BOT_TOKEN", None)
+os.environ.pop("CATALOG_CACHE", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import bot  # noqa: E402
+from models import db, Movie  # noqa: E402
+
+
+def movie_names(session):
+    return sorted(session.execute(db.select(Movie.name)).scalars())
+
+
+@pytest.fixture(autouse=True)
+def databases():
+    """Primary va replica'da har xil kino: o'qish qayerdan kelganini nomdan bilish mumkin"""
+    with bot.app.app_context():
+        replica = db.engines["replica_0"]
+        db.metadata.create_all(replica, tables=[Movie.__table__])
+        for engine, name in ((db.engine, "primary"), (replica, "replica")):
+            with engine.begin() as conn:
+                conn.execute(db.delete(Movie))
+                conn.execute(db.insert(Movie), [{'movie_id': name, 'name': name, 'file_id': name, 'file_type': 'video'}])
+    bot.replica_state['last_write'] = 0.0
+    bot.replica_state['down_until'].clear()
+    yield
+    bot.replica_state['down_until'].clear()
+
+
+def test_reads_go_to_replica():
+    assert bot.run_read(movie_names) == ["replica"]
+
+
+def test_reads_stick_to_primary_after_catalog_write():
+    bot.mark_catalog_write()
+    assert bot.run_read(movie_names) == ["primary"]
+
+    bot.replica_state['last_write'] -= bot.REPLICA_STICKY_SECONDS
+    assert bot.run_read(movie_names) == ["replica"]
+
+
+def test_failed_replica_falls_back_and_is_marked_down():
+    with bot.app.app_context():
+        Movie.__table__.drop(db.engines["replica_0"])
+
+    assert bot.run_read(movie_names) == ["primary"]
+    assert "replica_0" in bot.replica_state['down_until']
+    assert bot.pick_replica() is None
+
+    # Qayta urinish vaqti o'tgach replica yana tanlanadi
+    bot.replica_state['down_until']["replica_0"] = 0
+    assert bot.pick_replica() == "replica_0"